@@ -0,0 +1,111 @@
+import logging
+from typing import Sequence, Tuple
+
+import numpy as np
+
+from tiles import Window
+
+BACKENDS = ('auto', 'opencl', 'multi', 'numpy')
+
+logger = logging.getLogger(__name__)
+
+
+class Backend:
+    """Executes the per-pixel map kernels.
+
+    Kernels take and return backend arrays, which stay on the device until to_host() is called.
+    """
+    name = None
+    # Set to a profiling.Profiler to record kernel and transfer times
+    profiler = None
+
+    def to_device(self, array: np.ndarray):
+        raise NotImplementedError
+
+    def to_host(self, array) -> np.ndarray:
+        raise NotImplementedError
+
+    def release(self, array) -> None:
+        pass
+
+    def min_max(self, array) -> Tuple[float, float]:
+        raise NotImplementedError
+
+    def height_map(self, window: Window, octaves: Sequence[Tuple[int, float, float]]):
+        # Sum of the (seed, scale, effect) noise octaves, scaled down towards the edges of the world
+        raise NotImplementedError
+
+    def height_maps(self, window: Window, octave_sets: Sequence[Sequence[Tuple[int, float, float]]]):
+        # height_map for many seeds at once as one (maps, height, width) array, all sets share scales and effects
+        raise NotImplementedError
+
+    def batch_item(self, array, index: int):
+        # Map index of a height_maps result as a 2d array
+        raise NotImplementedError
+
+    def mean(self, height_map, radius: int):
+        raise NotImplementedError
+
+    def gradient_directions(self, height_map, slope: bool = False) -> Tuple:
+        # Direction codes of the central difference gradients, with their magnitudes when slope is set, else None
+        raise NotImplementedError
+
+    def flow_accumulation(self, directions):
+        raise NotImplementedError
+
+    def land_mask(self, height_map, sea_height: float):
+        # uint8 array, 1 where the height is above sea_height compared as float32, else 0
+        raise NotImplementedError
+
+    def lut_colors(self, height_map, lut: np.ndarray, low: float, high: float, rivers=None, river_threshold: int = 0,
+                   sea_height: float = 0.0):
+        # Interleaved RGBA, rivers is an optional flow accumulation drawn on land above river_threshold
+        raise NotImplementedError
+
+    def erode(self, height_map, erosion, progress=None):
+        # New heights after erosion.iterations steps of an erosion.Erosion, height_map is left as it is.
+        # progress(done, total) is called every erosion.PROGRESS_INTERVAL iterations, see erosion.Progress
+        raise NotImplementedError
+
+
+def lut_scale(lut: np.ndarray, low: float, high: float) -> float:
+    # Lookup table entries per height unit
+    return (len(lut) - 1) / (high - low) if high > low else 0.0
+
+
+def _opencl_context():
+    # None without pyopencl or an OpenCL device, program build errors and the like come later from CLBackend
+    try:
+        import pyopencl as cl
+    except ImportError as e:
+        logger.warning("OpenCL is not available, using the numpy backend: %s", e)
+        return None
+    try:
+        return cl.create_some_context(interactive=False)
+    except cl.Error as e:
+        # LogicError and RuntimeError from the platform and device enumeration are Errors too
+        logger.warning("No usable OpenCL device, using the numpy backend: %s", e)
+        return None
+
+
+def create_backend(name: str = 'auto', workers: int = None, profiler=None) -> Backend:
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend {}, expected one of {}".format(name, ", ".join(BACKENDS)))
+    if name == 'multi':
+        # Every OpenCL device of every platform, with work split between them
+        import pyopencl as cl
+        from cl_backend import CLBackend, cl_devices
+        from multi_backend import MultiBackend
+        return MultiBackend([CLBackend(cl.Context([device]), profiler=profiler) for device in cl_devices()], profiler)
+    if name == 'opencl':
+        from cl_backend import CLBackend
+        return CLBackend(profiler=profiler)
+    if name == 'auto':
+        context = _opencl_context()
+        if context is not None:
+            from cl_backend import CLBackend
+            return CLBackend(context, profiler=profiler)
+    from numpy_backend import NumpyBackend
+    backend = NumpyBackend(workers)
+    backend.profiler = profiler
+    return backend
@@ -1,6 +1,9 @@
-import pyopencl as cl
+import hashlib
+
+import numpy as np
 from PIL import Image
 
+from backend import Backend
 from events import Invalidated
 from observables import Observable, Observer, Event
 
@@ -11,30 +14,118 @@ class Map(Observable, Observer):
         controller.subscribe(self)
         self.width = width
         self.height = height
+        self.inputs = []
+        # Maps only read when creating the host copy, they are not part of the key
+        self.host_inputs = []
         self._map = None
         self.image = None
         self.valid = False
 
+    def depends_on(self, *maps: 'Map') -> None:
+        # Inputs are generated before this map and invalidate it when they change
+        for input_map in maps:
+            self.inputs.append(input_map)
+            input_map.subscribe(self)
+
+    def reads_on_host(self, *maps: 'Map') -> None:
+        # Host inputs are generated with this map, their Invalidated events reach handle
+        for input_map in maps:
+            self.host_inputs.append(input_map)
+            input_map.subscribe(self)
+
     def generate(self) -> None:
         raise NotImplemented
 
     def get_image(self) -> Image:
         if not self.valid:
             self.generate()
+        if self.image is None:
+            self.image = self.create_image()
         return self.image
 
+    def create_image(self) -> Image:
+        return self.to_image(self.get_map())
+
+    @staticmethod
+    def to_image(array) -> Image:
+        # Image of a host array of this map type, also used for regions of the map
+        return None
+
     def get_map(self):
         if not self.valid:
             self.generate()
         return self._map
 
+    def parameters(self) -> tuple:
+        # Everything besides the inputs that the generated map depends on
+        return self.width, self.height
+
+    @property
+    def key(self) -> str:
+        description = repr((type(self).__name__, self.parameters(), [input_map.key for input_map in self.inputs]))
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    @property
+    def cacheable(self) -> bool:
+        return True
+
+    @property
+    def complete(self) -> bool:
+        # False while this map or one of its inputs was cut short, see HeightMap, such maps are never cached
+        return all(input_map.complete for input_map in self.inputs)
+
+    def dump(self) -> np.ndarray:
+        return self._map
+
+    def load(self, array: np.ndarray) -> None:
+        self._map = array
+        self.image = None
+        self.valid = True
+
+    def invalidate(self):
+        self.valid = False
+        self.notify(Invalidated())
+
     def handle(self, observable, event: Event):
         if type(event) is Invalidated:
-            self.valid = False
-            self.notify(event)
+            self.invalidate()
 
 
-class CLMap(Map):
-    def __init__(self, controller: Observable, width: int, height: int, context: cl.Context):
+class BackendMap(Map):
+    def __init__(self, controller: Observable, width: int, height: int, backend: Backend):
         super().__init__(controller, width, height)
-        self.ctx = context
+        self.backend = backend
+        self._data = None
+
+    def get_data(self):
+        if not self.valid:
+            self.generate()
+        return self._data
+
+    def set_data(self, data) -> None:
+        # Host copy and image are only created again when asked for
+        if self._data is not None and self._data is not data:
+            self.backend.release(self._data)
+        self._data = data
+        self._map = None
+        self.image = None
+
+    def get_map(self):
+        if not self.valid:
+            self.generate()
+        if self._map is None:
+            self._map = self.to_host()
+        return self._map
+
+    def to_host(self):
+        return self.backend.to_host(self._data)
+
+    def parameters(self):
+        return super().parameters() + (self.backend.name,)
+
+    def dump(self):
+        return self.backend.to_host(self._data)
+
+    def load(self, array):
+        self.set_data(self.backend.to_device(array))
+        self.valid = True
@@ -0,0 +1,159 @@
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from backend import create_backend
+from batch_generator import BatchGenerator
+from controller import LAYER_CLASSES, Controller
+from imageutils import save_image
+from main import check_positive_integer, erosion_settings, layer_cache, map_arguments, parse_map_arguments, scale_pair
+from maptypes import MapTypes
+from profiling import Profiler
+
+_backend = None
+_cache = None
+_profiler = None
+
+
+def parse_seeds(value):
+    # "1-100,200,300" style lists, ranges are inclusive
+    seeds = []
+    for part in value.split(','):
+        if '-' in part:
+            start, end = part.split('-')
+            seeds.extend(range(int(start), int(end) + 1))
+        else:
+            seeds.append(int(part))
+    return seeds
+
+
+def parse_sea_levels(value):
+    return [int(level) for level in value.split(',')]
+
+
+def _init_worker(args):
+    # One OpenCL context or thread pool per process, shared by all its jobs
+    global _backend, _cache, _profiler
+    _profiler = Profiler() if args.profile else None
+    _backend = create_backend(args.backend, args.workers, _profiler)
+    _cache = layer_cache(args)
+
+
+def _file_name(extension, seed, filter_index, sea_level, layer):
+    return "{}_f{}_s{}_{}.{}".format(seed, filter_index, sea_level, layer.name.lower(), extension)
+
+
+def generate(job):
+    args, seed, filter_index, filters = job
+    if _profiler is not None:
+        _profiler.reset()
+    # Seeds are strings when they come from the GUI or map.conf, keep batch output identical to those
+    controller = Controller(args.xSize, args.ySize, filters, args.sea_levels[0], str(seed), _backend,
+                            args.mean_radius, args.river_threshold, _cache, height_source=args.heightmap,
+                            height_dtype=args.height_dtype, erosion=erosion_settings(args),
+                            fill_depressions=args.fill_depressions)
+    written = []
+    for sea_level in args.sea_levels:
+        controller.set_sea_level(sea_level)
+        for layer in args.layers:
+            if args.format == 'image':
+                image = controller.get_map_image(layer)
+                extension = "tiff" if image.mode in ("F", "I") else "png"
+                path = os.path.join(args.output, _file_name(extension, seed, filter_index, sea_level, layer))
+                image.save(path)
+            else:
+                path = os.path.join(args.output, _file_name(args.format, seed, filter_index, sea_level, layer))
+                controller.export(layer, path)
+            written.append(path)
+    profile = None
+    if _profiler is not None:
+        profile = dict(_profiler.report(), seed=seed, filter_index=filter_index)
+    return written, profile
+
+
+def generate_batch(job):
+    # Like generate for several seeds, their height maps come from one dispatch
+    args, seeds, filter_index, filters = job
+    if _profiler is not None:
+        _profiler.reset()
+    written = []
+    for sea_level in args.sea_levels:
+        generator = BatchGenerator(_backend, args.xSize, args.ySize, filters, sea_level, args.mean_radius,
+                                   args.river_threshold, fill_depressions=args.fill_depressions)
+        outputs = generator.generate([str(seed) for seed in seeds], args.layers)
+        for (index, seed), layer in itertools.product(enumerate(seeds), args.layers):
+            array = outputs[layer][index]
+            if args.format == 'image':
+                image = LAYER_CLASSES[layer].to_image(array)
+                extension = "tiff" if image.mode in ("F", "I") else "png"
+                path = os.path.join(args.output, _file_name(extension, seed, filter_index, sea_level, layer))
+                image.save(path)
+            else:
+                path = os.path.join(args.output, _file_name(args.format, seed, filter_index, sea_level, layer))
+                save_image(array, path)
+            written.append(path)
+    profile = None
+    if _profiler is not None:
+        profile = dict(_profiler.report(), seeds=seeds, filter_index=filter_index)
+    return written, profile
+
+
+def main():
+    p = map_arguments("Generate maps for many seeds and parameters without the GUI")
+    p.add('--seeds', type=parse_seeds, help="Seeds to generate, for example 1-100,200")
+    p.add('--sea_levels', type=parse_sea_levels, help="Comma separated sea levels, defaults to --sea_level")
+    p.add('--filter_sweep', type=scale_pair, action='append',
+          help="Filter set to generate, may be repeated, defaults to --filters")
+    p.add('--layers', default=MapTypes.COLOR_MAP.name.lower(), help="Comma separated map types to write")
+    p.add('--format', choices=('image', 'npy', 'raw', 'r16'), default='image',
+          help="png/tiff images, .npy arrays, raw float32 or raw uint16 samples")
+    p.add('-o', '--output', required=True, help="Output directory")
+    p.add('-j', '--processes', type=check_positive_integer, default=os.cpu_count(), help="Worker processes")
+    p.add('--seed_batch', type=check_positive_integer, default=1,
+          help="Seeds whose height maps are generated in one dispatch, for generated float32 heights without erosion")
+    args = parse_map_arguments(p)
+    if args.seed_batch > 1 and (args.heightmap is not None or erosion_settings(args) is not None or
+                                args.height_dtype != 'float32'):
+        p.error("--seed_batch needs generated float32 heights without erosion")
+
+    args.seeds = args.seeds or [args.seed]
+    args.sea_levels = args.sea_levels or [args.sea_level]
+    args.layers = [MapTypes[name.strip().upper()] for name in args.layers.split(',')]
+    os.makedirs(args.output, exist_ok=True)
+
+    filter_sets = list(enumerate(args.filter_sweep or [args.filters]))
+    if args.seed_batch > 1:
+        batches = [args.seeds[start:start + args.seed_batch] for start in range(0, len(args.seeds), args.seed_batch)]
+        function, jobs = generate_batch, [(args, seeds, index, filters)
+                                          for seeds, (index, filters) in itertools.product(batches, filter_sets)]
+    else:
+        function, jobs = generate, [(args, seed, index, filters)
+                                    for seed, (index, filters) in itertools.product(args.seeds, filter_sets)]
+    # Spawn rather than fork, OpenCL contexts do not survive a fork
+    with ProcessPoolExecutor(args.processes, multiprocessing.get_context('spawn'), _init_worker,
+                             (args,)) as pool:
+        futures = [pool.submit(function, job) for job in jobs]
+        failed = 0
+        profiles = []
+        for future in as_completed(futures):
+            try:
+                written, profile = future.result()
+            except Exception as e:
+                failed += 1
+                print("Generation failed: {}".format(e), file=sys.stderr)
+                continue
+            for path in written:
+                print(path)
+            if profile is not None:
+                profiles.append(profile)
+    if args.profile:
+        with open(args.profile, "w") as f:
+            json.dump({"jobs": profiles}, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
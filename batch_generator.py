@@ -0,0 +1,127 @@
+from typing import Dict, Sequence
+
+import numpy as np
+
+from backend import Backend
+from color_map import DEFAULT_COLOR_RANGES, ColorRange, color_lut, height_ranges
+from continent_map import LAND_DTYPE
+from depressions import priority_flood, route
+from height_map import octaves
+from maptypes import MapTypes
+from river_map import FLOW_DTYPE, FLOW_MAX
+from tiles import Window
+
+BATCH_LAYERS = (MapTypes.HEIGHT_MAP,)
+# Layers made from the gradient directions
+GRADIENT_LAYERS = (MapTypes.GRADIENT_MAP, MapTypes.SLOPE_MAP, MapTypes.RIVER_MAP, MapTypes.COLOR_MAP)
+# Layers made from the filled depressions, rivers and colors too when they are routed across them
+FLOOD_LAYERS = (MapTypes.FILLED_HEIGHT_MAP, MapTypes.LAKE_MAP, MapTypes.LAKE_DEPTH_MAP)
+ROUTED_LAYERS = (MapTypes.RIVER_MAP, MapTypes.COLOR_MAP)
+
+
+class BatchGenerator:
+    """Generates the maps of many seeds at once into contiguous (seeds, height, width) arrays.
+
+    The height maps of all seeds come from one kernel dispatch, the other layers are made from them one map at a
+    time and match what a Controller with the same parameters generates.
+    """
+
+    def __init__(self, backend: Backend, width: int, height: int, filters, sea_level=75, mean_radius=30,
+                 river_threshold=500, color_ranges: Sequence[ColorRange] = DEFAULT_COLOR_RANGES,
+                 fill_depressions=False):
+        self.backend = backend
+        self.width = width
+        self.height = height
+        self.filters = filters
+        self.sea_level = sea_level
+        self.mean_radius = mean_radius
+        self.river_threshold = river_threshold
+        self.color_ranges = color_ranges
+        self.fill_depressions = fill_depressions
+
+    def generate(self, seeds: Sequence, layers=BATCH_LAYERS) -> Dict[MapTypes, np.ndarray]:
+        backend = self.backend
+        shape = (len(seeds), self.height, self.width)
+        outputs = {}
+        for layer in layers:
+            if layer is MapTypes.COLOR_MAP:
+                outputs[layer] = np.empty(shape + (4,), np.uint8)
+            elif layer is MapTypes.GRADIENT_MAP:
+                outputs[layer] = np.empty(shape, np.uint8)
+            elif layer is MapTypes.CONTINENT_MAP or layer is MapTypes.LAKE_MAP:
+                outputs[layer] = np.empty(shape, LAND_DTYPE)
+            elif layer is MapTypes.RIVER_MAP:
+                outputs[layer] = np.empty(shape, FLOW_DTYPE)
+            else:
+                outputs[layer] = np.empty(shape, np.float32)
+
+        if not seeds:
+            return outputs
+        window = Window.full(self.width, self.height)
+        heights = backend.height_maps(window, [octaves(seed, self.filters) for seed in seeds])
+        if MapTypes.HEIGHT_MAP in outputs:
+            outputs[MapTypes.HEIGHT_MAP][:] = backend.to_host(heights)
+        if any(layer is not MapTypes.HEIGHT_MAP for layer in outputs):
+            for index in range(len(seeds)):
+                height_map = backend.batch_item(heights, index)
+                self._generate_layers(height_map, {layer: output[index] for layer, output in outputs.items()})
+                backend.release(height_map)
+        backend.release(heights)
+        return outputs
+
+    def _generate_layers(self, heights, outputs):
+        backend = self.backend
+        temporary = []
+        low, high = backend.min_max(heights)
+        effective_sea_level = high * self.sea_level / 100
+        flow = None
+        if any(layer in GRADIENT_LAYERS or layer in FLOOD_LAYERS or layer is MapTypes.MEAN_HEIGHT_MAP
+               for layer in outputs):
+            mean = backend.mean(heights, self.mean_radius)
+            temporary.append(mean)
+            if MapTypes.MEAN_HEIGHT_MAP in outputs:
+                outputs[MapTypes.MEAN_HEIGHT_MAP][:] = backend.to_host(mean)
+            if any(layer in FLOOD_LAYERS or self.fill_depressions and layer in ROUTED_LAYERS for layer in outputs):
+                surface = backend.to_host(mean)
+                filled, parents = priority_flood(surface)
+                if MapTypes.FILLED_HEIGHT_MAP in outputs:
+                    outputs[MapTypes.FILLED_HEIGHT_MAP][:] = filled
+            if any(layer in GRADIENT_LAYERS for layer in outputs):
+                directions, slope = backend.gradient_directions(mean, MapTypes.SLOPE_MAP in outputs)
+                temporary.append(directions)
+                if MapTypes.GRADIENT_MAP in outputs:
+                    outputs[MapTypes.GRADIENT_MAP][:] = backend.to_host(directions)
+                if slope is not None:
+                    temporary.append(slope)
+                    outputs[MapTypes.SLOPE_MAP][:] = backend.to_host(slope)
+                if (MapTypes.RIVER_MAP in outputs or MapTypes.COLOR_MAP in outputs) and self.fill_depressions:
+                    routed = backend.to_device(route(backend.to_host(directions), filled, parents))
+                    flow = backend.flow_accumulation(routed)
+                    temporary.extend((routed, flow))
+                elif MapTypes.RIVER_MAP in outputs or MapTypes.COLOR_MAP in outputs:
+                    flow = backend.flow_accumulation(directions)
+                    temporary.append(flow)
+        if any(layer in (MapTypes.CONTINENT_MAP, MapTypes.RIVER_MAP, MapTypes.LAKE_MAP, MapTypes.LAKE_DEPTH_MAP)
+               for layer in outputs):
+            # Compared as float32 like ContinentMap
+            land = backend.to_host(heights) > np.float32(effective_sea_level)
+            if MapTypes.CONTINENT_MAP in outputs:
+                outputs[MapTypes.CONTINENT_MAP][:] = land
+            if MapTypes.RIVER_MAP in outputs:
+                rivers = outputs[MapTypes.RIVER_MAP]
+                flow_counts = backend.to_host(flow)
+                np.minimum(flow_counts, FLOW_MAX, out=rivers, casting='unsafe')
+                rivers[(flow_counts < self.river_threshold) | ~land] = 0
+            if MapTypes.LAKE_MAP in outputs or MapTypes.LAKE_DEPTH_MAP in outputs:
+                lakes = (filled > surface) & land
+                if MapTypes.LAKE_MAP in outputs:
+                    outputs[MapTypes.LAKE_MAP][:] = lakes
+                if MapTypes.LAKE_DEPTH_MAP in outputs:
+                    outputs[MapTypes.LAKE_DEPTH_MAP][:] = np.where(lakes, filled - surface, np.float32(0))
+        if MapTypes.COLOR_MAP in outputs:
+            lut = color_lut(height_ranges(self.color_ranges, self.sea_level, high), low, high)
+            colors = backend.lut_colors(heights, lut, low, high, flow, self.river_threshold, effective_sea_level)
+            temporary.append(colors)
+            outputs[MapTypes.COLOR_MAP][:] = backend.to_host(colors)
+        for array in temporary:
+            backend.release(array)
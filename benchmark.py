@@ -0,0 +1,144 @@
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from backend import create_backend
+from controller import Controller
+from main import erosion_settings, map_arguments, scale_pair
+from maptypes import MapTypes
+from profiling import Profiler
+
+
+def parse_integers(value):
+    return [int(part) for part in value.split(',')]
+
+
+def octave_filters(filters, count: int):
+    # First count filters, continued past the configured ones with doubled scales and halved effects
+    result = list(filters[:count])
+    while len(result) < count:
+        last = result[-1]
+        result.append(scale_pair("{}/{}".format(last.scale * 2, last.effect / 2))[0])
+    return result
+
+
+def backend_factories(names, workers=None):
+    # (name, factory) per backend, opencl stands for every OpenCL device on its own
+    factories = []
+    for name in names:
+        if name == 'opencl':
+            import pyopencl as cl
+            from cl_backend import CLBackend, cl_devices
+            for device in cl_devices():
+                factories.append(("opencl:" + device.name.strip(),
+                                  lambda profiler, device=device: CLBackend(cl.Context([device]), profiler=profiler)))
+        else:
+            factories.append((name, lambda profiler, name=name: create_backend(name, workers, profiler)))
+    return factories
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(factory, width, height, filters, radius, layer, args, repeats):
+    # A new backend for every run, its creation and program builds are reported next to the cold run.
+    # Timed runs leave out host memory tracing, which slows Python code down, a last cold run measures the peaks
+    profiler = Profiler()
+    start = time.perf_counter()
+    backend = factory(profiler)
+    init_time = time.perf_counter() - start
+    timings = []
+    result = None
+    for run_index in range(repeats + 1):
+        profiler.reset()
+        controller = Controller(width, height, filters, args.sea_level, str(args.seed), backend, radius,
+                                args.river_threshold, height_dtype=args.height_dtype, erosion=erosion_settings(args),
+                                fill_depressions=args.fill_depressions)
+        start = time.perf_counter()
+        controller.get_map(layer)
+        timings.append(time.perf_counter() - start)
+        report = profiler.report()
+        if run_index == 0:
+            result = {"init_time": init_time, "builds": report["builds"], "cold_time": timings[0],
+                      "cold_peak_bytes": report["peak_bytes"]}
+    with Profiler(trace_host_memory=True) as traced:
+        Controller(width, height, filters, args.sea_level, str(args.seed), factory(traced), radius,
+                   args.river_threshold, height_dtype=args.height_dtype, erosion=erosion_settings(args),
+                   fill_depressions=args.fill_depressions).get_map(layer)
+        peak_bytes = traced.report()["peak_bytes"]
+    warm = timings[1:]
+    median = statistics.median(warm)
+    result.update({
+        "warm_times": warm,
+        "warm_median": median,
+        "megapixels_per_second": width * height / 1e6 / median if median > 0 else None,
+        "peak_bytes": peak_bytes,
+        "stages": report["stages"],
+    })
+    return result
+
+
+def main():
+    p = map_arguments("Time every layer over map sizes, octave counts, mean radii and backends")
+    p.add('--sizes', type=parse_integers, default=[256, 1024, 4096],
+          help="Comma separated square map sizes, up to 16384 on machines with the memory for it")
+    p.add('--octaves', type=parse_integers, default=[1, 3, 6], help="Comma separated noise octave counts")
+    p.add('--radii', type=parse_integers, help="Comma separated mean radii, defaults to --mean_radius")
+    p.add('--backends', default='numpy,opencl', help="Comma separated backends, opencl runs on every device")
+    p.add('--layers', help="Comma separated map types, defaults to all")
+    p.add('--repeats', type=int, default=3, help="Warm runs after the cold one, at least one")
+    p.add('-o', '--output', default='benchmark.json', help="JSON file of the results")
+    # Same maps in every run unless a seed is given
+    p.set_defaults(seed=1)
+    args = p.parse_args()
+    if args.repeats < 1:
+        p.error("--repeats needs at least one warm run to time")
+    # Every run generates its maps, the results go to --output
+    for option in ('heightmap', 'cache_dir', 'profile'):
+        if getattr(args, option) is not None:
+            p.error("--{} is not supported by the benchmark".format(option))
+
+    layers = [MapTypes[name.strip().upper()] for name in args.layers.split(',')] if args.layers else list(MapTypes)
+    results = []
+    for (name, factory), size, octaves, radius, layer in itertools.product(
+            backend_factories(args.backends.split(','), args.workers), args.sizes, args.octaves,
+            args.radii or [args.mean_radius], layers):
+        try:
+            result = run(factory, size, size, octave_filters(args.filters, octaves), radius, layer, args,
+                         args.repeats)
+        except Exception as e:
+            print("{} {} failed: {}".format(name, size, e), file=sys.stderr)
+            result = {"error": str(e)}
+        results.append(dict(result, backend=name, width=size, height=size, octaves=octaves, mean_radius=radius,
+                            layer=layer.name.lower()))
+        if "error" not in result:
+            print("{:<24} {:>6}² {} octaves r{:<3} {:<16} cold {:8.3f} s warm {:8.3f} s {:8.1f} MP/s".format(
+                name, size, octaves, radius, layer.name.lower(), result["cold_time"], result["warm_median"],
+                result["megapixels_per_second"] or 0))
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "seed": str(args.seed),
+            "results": results,
+        }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
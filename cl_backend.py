@@ -0,0 +1,290 @@
+import threading
+import time
+
+import numpy as np
+import pyopencl as cl
+
+from backend import Backend, lut_scale
+from cl_buffers import BufferPool, DeviceArray
+from cl_programs import ProgramCache, program_cache
+from erosion import PROGRESS_INTERVAL, proceed
+
+# Flow accumulation levels launched between two reads of the frontier size
+FLOW_LEVELS_PER_READ = 32
+
+
+def cl_devices():
+    return [device for platform in cl.get_platforms() for device in platform.get_devices()]
+
+
+class CLBackend(Backend):
+    name = 'opencl'
+
+    def __init__(self, context: cl.Context = None, programs: ProgramCache = None, profiler=None):
+        self.ctx = context if context is not None else cl.create_some_context(interactive=False)
+        self.profiler = profiler
+        properties = cl.command_queue_properties.PROFILING_ENABLE if profiler is not None else 0
+        self.queue = cl.CommandQueue(self.ctx, properties=properties)
+        self.buffers = BufferPool(self.ctx, profiler)
+        self._programs = programs or program_cache
+        self.noise = self._program("noise/Noise.cl")
+        self.map_tools = self._program("maptools.cl")
+        self._erosion = None
+        self._local = threading.local()
+
+    def _program(self, filename: str) -> cl.Program:
+        start = time.perf_counter()
+        program = self._programs.get(self.ctx, filename)
+        if self.profiler is not None:
+            self.profiler.build(filename, time.perf_counter() - start)
+        return program
+
+    @property
+    def erosion(self) -> cl.Program:
+        # Built on first use, most maps are never eroded
+        if self._erosion is None:
+            self._erosion = self._program("erosion.cl")
+        return self._erosion
+
+    def kernel(self, program: cl.Program, name: str) -> cl.Kernel:
+        # Kernel arguments are set on the kernel object, every thread needs its own
+        kernels = self._local.__dict__.setdefault('kernels', {})
+        key = (program.int_ptr, name)
+        if key not in kernels:
+            kernels[key] = cl.Kernel(program, name)
+        kernel = kernels[key]
+        if self.profiler is None:
+            return kernel
+        return lambda *args: self.profiler.kernel(name, kernel(*args))
+
+    def _copy(self, destination, source, nbytes: int, direction: str):
+        event = cl.enqueue_copy(self.queue, destination, source)
+        if self.profiler is not None:
+            self.profiler.transfer(direction, nbytes, event)
+        return event
+
+    def empty(self, shape, dtype) -> DeviceArray:
+        return self.buffers.acquire(shape, dtype)
+
+    def full(self, shape, value) -> DeviceArray:
+        array = self.empty(shape, value.dtype)
+        cl.enqueue_fill_buffer(self.queue, array.buffer, value, 0, array.nbytes)
+        return array
+
+    def to_device(self, array):
+        array = np.ascontiguousarray(array)
+        result = self.empty(array.shape, array.dtype)
+        self._copy(result.buffer, array, array.nbytes, "to_device")
+        return result
+
+    def to_host(self, array):
+        result = np.empty(array.shape, array.dtype)
+        self._copy(result, array.buffer, array.nbytes, "to_host")
+        return result
+
+    def release(self, array):
+        self.buffers.release(array)
+
+    def batch_item(self, array, index):
+        item = self.empty(array.shape[1:], array.dtype)
+        cl.enqueue_copy(self.queue, item.buffer, array.buffer, byte_count=item.nbytes, src_offset=index * item.nbytes)
+        return item
+
+    def min_max(self, array):
+        height, width = array.shape
+        rows = self.empty((height, 2), np.float32)
+        self.kernel(self.map_tools, 'row_min_max')(self.queue, (height,), None,
+                                                   array.buffer,
+                                                   rows.buffer,
+                                                   np.int32(width))
+        host_rows = self.to_host(rows)
+        self.release(rows)
+        return float(host_rows[:, 0].min()), float(host_rows[:, 1].max())
+
+    def height_map(self, window, octaves):
+        return self._height_maps(window, [octaves], window.shape)
+
+    def height_maps(self, window, octave_sets):
+        return self._height_maps(window, octave_sets, (len(octave_sets),) + window.shape)
+
+    def _height_maps(self, window, octave_sets, shape):
+        result = self.empty(shape, np.float32)
+        # At least one entry, OpenCL buffers can not be empty
+        seeds = self.to_device(np.array([seed for octaves in octave_sets for seed, _, _ in octaves] or [0], np.int32))
+        scale_effect = self.to_device(np.array([(scale, effect) for _, scale, effect in octave_sets[0]] or [(0, 0)],
+                                               np.float32))
+        self.kernel(self.noise, 'IslandHeightMap')(self.queue, (len(octave_sets),) + window.shape, None,
+                                                   result.buffer,
+                                                   seeds.buffer,
+                                                   scale_effect.buffer,
+                                                   np.int32(len(octave_sets[0])),
+                                                   np.int32(window.width), np.int32(window.height),
+                                                   np.int32(window.x), np.int32(window.y),
+                                                   np.int32(window.world_width), np.int32(window.world_height),
+                                                   np.int32(window.step))
+        self.release(seeds)
+        self.release(scale_effect)
+        return result
+
+    def mean(self, height_map, radius):
+        height, width = height_map.shape
+        # Long enough segments keep the per pixel cost constant, short enough ones keep the device busy
+        segment = max(2 * radius + 1, 32)
+        row_sums = self.empty(height_map.shape, np.float32)
+        result = self.empty(height_map.shape, np.float32)
+        self.kernel(self.map_tools, 'box_sum_rows')(self.queue, (height, -(-width // segment)), None,
+                                                    height_map.buffer,
+                                                    row_sums.buffer,
+                                                    np.int32(radius),
+                                                    np.int32(width),
+                                                    np.int32(segment))
+        self.kernel(self.map_tools, 'box_mean_columns')(self.queue, (-(-height // segment), width), None,
+                                                        row_sums.buffer,
+                                                        result.buffer,
+                                                        np.int32(radius),
+                                                        np.int32(width),
+                                                        np.int32(height),
+                                                        np.int32(segment))
+        self.release(row_sums)
+        return result
+
+    def gradient_directions(self, height_map, slope=False):
+        height, width = height_map.shape
+        directions = self.empty(height_map.shape, np.uint8)
+        slopes = self.empty(height_map.shape, np.float32) if slope else None
+        self.kernel(self.map_tools, 'gradient_directions')(self.queue, (height, width), None,
+                                                           height_map.buffer,
+                                                           directions.buffer,
+                                                           slopes.buffer if slopes is not None else None,
+                                                           np.int32(width),
+                                                           np.int32(height))
+        return directions, slopes
+
+    def flow_accumulation(self, directions):
+        height, width = directions.shape
+        size = directions.size
+        flow = self.empty(directions.shape, np.uint32)
+        indegree = self.full((size,), np.uint32(0))
+        frontiers = [self.empty((size,), np.int32), self.empty((size,), np.int32)]
+        frontier_sizes = [self.full((1,), np.uint32(0)), self.empty((1,), np.uint32)]
+        count = np.zeros(1, np.uint32)
+
+        self.kernel(self.map_tools, 'flow_init')(self.queue, (size,), None,
+                                                 directions.buffer,
+                                                 flow.buffer,
+                                                 indegree.buffer,
+                                                 np.int32(width),
+                                                 np.int32(height))
+        self.kernel(self.map_tools, 'flow_sources')(self.queue, (size,), None,
+                                                    indegree.buffer,
+                                                    frontiers[0].buffer,
+                                                    frontier_sizes[0].buffer)
+        self._copy(count, frontier_sizes[0].buffer, count.nbytes, "to_host")
+        push = self.kernel(self.map_tools, 'flow_push')
+        # One launch per topological level, each cell is pushed exactly once. Every cell has one downstream cell,
+        # so no frontier is larger than the one before and the last count read back bounds the next levels
+        while count[0]:
+            for _ in range(FLOW_LEVELS_PER_READ):
+                cl.enqueue_fill_buffer(self.queue, frontier_sizes[1].buffer, np.uint32(0), 0, 4)
+                # Fixed work group size, launches only differ in their number of groups
+                push(self.queue, (-(-int(count[0]) // 64) * 64,), (64,),
+                     directions.buffer,
+                     flow.buffer,
+                     indegree.buffer,
+                     frontiers[0].buffer,
+                     frontiers[1].buffer,
+                     frontier_sizes[0].buffer,
+                     frontier_sizes[1].buffer,
+                     np.int32(width),
+                     np.int32(height))
+                frontiers.reverse()
+                frontier_sizes.reverse()
+            self._copy(count, frontier_sizes[0].buffer, count.nbytes, "to_host")
+
+        for array in frontiers + frontier_sizes + [indegree]:
+            self.release(array)
+        return flow
+
+    def land_mask(self, height_map, sea_height):
+        mask = self.empty(height_map.shape, np.uint8)
+        self.kernel(self.map_tools, 'land_mask')(self.queue, (height_map.size,), None,
+                                                 height_map.buffer,
+                                                 mask.buffer,
+                                                 np.float32(sea_height))
+        return mask
+
+    def lut_colors(self, height_map, lut, low, high, rivers=None, river_threshold=0, sea_height=0.0):
+        height, width = height_map.shape
+        colors = self.empty(height_map.shape + (4,), np.uint8)
+        lut_buf = self.to_device(lut)
+        self.kernel(self.map_tools, 'lut_colors')(self.queue, (height, width), None,
+                                                  height_map.buffer,
+                                                  lut_buf.buffer,
+                                                  rivers.buffer if rivers is not None else None,
+                                                  colors.buffer,
+                                                  np.float32(low),
+                                                  np.float32(lut_scale(lut, low, high)),
+                                                  np.int32(len(lut)),
+                                                  np.uint32(river_threshold),
+                                                  np.float32(sea_height),
+                                                  np.int32(width))
+        self.release(lut_buf)
+        return colors
+
+    def erode(self, height_map, erosion, progress=None):
+        height, width = height_map.shape
+        shape = height_map.shape
+        zero = np.float32(0)
+        terrain = [self.empty(shape, np.float32), self.empty(shape, np.float32)]
+        cl.enqueue_copy(self.queue, terrain[0].buffer, height_map.buffer, byte_count=height_map.nbytes)
+        water = [self.full(shape, zero), self.empty(shape, np.float32)]
+        sediment = [self.full(shape, zero), self.empty(shape, np.float32)]
+        flux = [self.full(shape + (4,), zero), self.empty(shape + (4,), np.float32)]
+        buffers = terrain + water + sediment + flux
+        flux_kernel = self.kernel(self.erosion, 'erosion_flux')
+        water_kernel = self.kernel(self.erosion, 'erosion_water')
+        thermal_kernel = self.kernel(self.erosion, 'thermal_erosion')
+        dt = np.float32(erosion.time_step)
+        rain = np.float32(erosion.rain)
+        try:
+            # Every launch reads the first buffer of each pair and writes the second, nothing is copied to the
+            # host. At each progress report the host waits for the iterations so far, like the numpy backend
+            for done in range(1, erosion.iterations + 1):
+                if erosion.hydraulic:
+                    flux_kernel(self.queue, shape, None,
+                                terrain[0].buffer, water[0].buffer, flux[0].buffer, flux[1].buffer,
+                                rain, dt, np.int32(width), np.int32(height))
+                    flux.reverse()
+                    event = water_kernel(self.queue, shape, None,
+                                         terrain[0].buffer, water[0].buffer, sediment[0].buffer, flux[0].buffer,
+                                         terrain[1].buffer, water[1].buffer, sediment[1].buffer,
+                                         rain, dt,
+                                         np.float32(erosion.evaporation),
+                                         np.float32(erosion.capacity),
+                                         np.float32(erosion.dissolving),
+                                         np.float32(erosion.deposition),
+                                         np.float32(erosion.min_tilt),
+                                         np.int32(width), np.int32(height))
+                    for pair in (terrain, water, sediment):
+                        pair.reverse()
+                if erosion.thermal:
+                    event = thermal_kernel(self.queue, shape, None,
+                                           terrain[0].buffer, terrain[1].buffer,
+                                           np.float32(erosion.talus),
+                                           np.float32(erosion.thermal_rate),
+                                           np.int32(width), np.int32(height))
+                    terrain.reverse()
+                if done % PROGRESS_INTERVAL == 0 or done == erosion.iterations:
+                    event.wait()
+                    if not proceed(progress, done, erosion.iterations):
+                        break
+
+            result = self.empty(shape, np.float32)
+            self.kernel(self.erosion, 'erosion_settle')(self.queue, (height_map.size,), None,
+                                                        terrain[0].buffer,
+                                                        sediment[0].buffer,
+                                                        result.buffer)
+        finally:
+            for array in buffers:
+                self.release(array)
+        return result
@@ -0,0 +1,54 @@
+import threading
+from collections import defaultdict
+
+import numpy as np
+import pyopencl as cl
+
+
+class DeviceArray:
+    """A (height, width) layer living in an OpenCL buffer."""
+
+    def __init__(self, buffer: cl.Buffer, shape, dtype):
+        self.buffer = buffer
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self) -> int:
+        return self.size * self.dtype.itemsize
+
+
+class BufferPool:
+    """Recycles device buffers by byte size and dtype so regenerating a layer does not allocate."""
+
+    def __init__(self, ctx: cl.Context, profiler=None):
+        self.ctx = ctx
+        self.profiler = profiler
+        self._free = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def acquire(self, shape, dtype) -> DeviceArray:
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        with self._lock:
+            free = self._free[(nbytes, dtype.str)]
+            buffer = free.pop() if free else None
+        if buffer is None:
+            buffer = cl.Buffer(self.ctx, cl.mem_flags.READ_WRITE, size=max(nbytes, 1))
+        if self.profiler is not None:
+            self.profiler.memory("device", nbytes)
+        return DeviceArray(buffer, shape, dtype)
+
+    def release(self, array: DeviceArray) -> None:
+        with self._lock:
+            self._free[(array.nbytes, array.dtype.str)].append(array.buffer)
+        if self.profiler is not None:
+            self.profiler.memory("device", -array.nbytes)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._free.clear()
@@ -0,0 +1,60 @@
+import hashlib
+import os
+import threading
+import weakref
+
+import pyopencl as cl
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "map-generator", "cl")
+
+
+class ProgramCache:
+    """Builds each OpenCL program once per context and keeps device binaries on disk between runs."""
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir or os.environ.get("MAP_GENERATOR_CL_CACHE", DEFAULT_CACHE_DIR)
+        self._programs = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, ctx: cl.Context, filename: str, options: str = "") -> cl.Program:
+        with open(filename) as f:
+            source = f.read()
+        source_hash = hashlib.sha256((source + "\0" + options).encode()).hexdigest()
+        with self._lock:
+            programs = self._programs.setdefault(ctx, {})
+            if source_hash not in programs:
+                programs[source_hash] = self._build(ctx, source, source_hash, options)
+            return programs[source_hash]
+
+    def _binary_path(self, source_hash: str, device: cl.Device) -> str:
+        device_id = "\0".join((device.platform.name, device.name, device.version, device.driver_version))
+        key = hashlib.sha256((source_hash + "\0" + device_id).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + ".bin")
+
+    def _build(self, ctx: cl.Context, source: str, source_hash: str, options: str) -> cl.Program:
+        paths = [self._binary_path(source_hash, device) for device in ctx.devices]
+        if all(os.path.exists(path) for path in paths):
+            try:
+                binaries = []
+                for path in paths:
+                    with open(path, "rb") as f:
+                        binaries.append(f.read())
+                return cl.Program(ctx, ctx.devices, binaries).build(options)
+            except (cl.Error, OSError):
+                # Stale or truncated binary, fall back to compiling the source
+                pass
+
+        program = cl.Program(ctx, source).build(options)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for path, binary in zip(paths, program.get_info(cl.program_info.BINARIES)):
+                temporary = "{}.{}.tmp".format(path, os.getpid())
+                with open(temporary, "wb") as f:
+                    f.write(binary)
+                os.replace(temporary, path)
+        except OSError:
+            pass
+        return program
+
+
+program_cache = ProgramCache()
@@ -1,12 +1,12 @@
-from typing import Sequence
+from typing import Optional, Sequence
 
 import numpy as np
-import pyopencl as cl
 from PIL import Image
 from webcolors import hex_to_rgb
 
-from base_maps import CLMap
-from events import SeaLevel, Invalidated
+from backend import Backend
+from base_maps import BackendMap
+from events import SeaLevel
 from height_map import HeightMap
 from observables import Observable, Event
 from river_map import RiverMap
@@ -21,80 +21,90 @@ class ColorRange:
         self.underwater = underwater
 
 
-class ColorMap(CLMap):
-    def __init__(self, controller: Observable, width: int, height: int, context: cl.Context,
+LUT_SIZE = 16384
+
+DEFAULT_COLOR_RANGES = [ColorRange(0, 100, True, [30, 80, 160, 0], [91, 154, 255, 0]),
+                        ColorRange(0, 30, False, [255, 243, 114, 0], [76, 211, 27, 0]),
+                        ColorRange(30, 80, False, [119, 255, 73, 0], [55, 122, 33, 0]),
+                        ColorRange(80, 100, False, [255, 240, 220, 0], [255, 211, 240, 0])
+                        ]
+
+
+def height_ranges(color_ranges: Sequence[ColorRange], sea_level, max_height):
+    # Percentages of the color ranges turned into absolute heights
+    effective_sea_level = max_height * sea_level / 100
+    result = []
+    for color_range in color_ranges:
+        if color_range.underwater:
+            start = color_range.start * effective_sea_level / 100
+            end = color_range.end * effective_sea_level / 100
+        else:
+            start = effective_sea_level + color_range.start * (max_height - effective_sea_level) / 100
+            end = effective_sea_level + color_range.end * (max_height - effective_sea_level) / 100
+        result.append((start, end, color_range.start_rgb, color_range.end_rgb))
+    return result
+
+
+def color_lut(height_ranges, low: float, high: float, size: int = LUT_SIZE) -> np.ndarray:
+    # Colors of size evenly spaced heights from low to high, later ranges are drawn over earlier ones
+    heights = np.linspace(low, high, size, dtype=np.float32)
+    lut = np.zeros((size, 4), np.uint8)
+    lut[:, 3] = 255
+    for start, end, start_rgb, end_rgb in height_ranges:
+        inside = (heights > start) & (heights <= end)
+        percentage = (heights[inside] - np.float32(start)) / (np.float32(end) - np.float32(start))
+        for channel in range(3):
+            lut[inside, channel] = start_rgb[channel] * (1 - percentage) + end_rgb[channel] * percentage
+    return lut
+
+
+class ColorMap(BackendMap):
+    def __init__(self, controller: Observable, width: int, height: int, backend: Backend,
                  height_map: HeightMap,
-                 river_map: RiverMap,
+                 river_map: Optional[RiverMap],
                  sea_level: int,
                  color_ranges: Sequence[ColorRange]):
-        super().__init__(controller, width, height, context)
+        super().__init__(controller, width, height, backend)
         self.height_map = height_map
-        self.height_map.subscribe(self)
         self.river_map = river_map
-        self.river_map.subscribe(self)
+        self.depends_on(height_map)
+        if river_map is not None:
+            self.depends_on(river_map)
         self._sea_level = sea_level
         self._color_buffers = color_ranges
-        self.map_tools = cl.Program(self.ctx, open("maptools.cl").read()).build()
-        self.generate()
 
     def generate(self):
         if self.valid:
             return
-        queue = cl.CommandQueue(self.ctx)
-
-        r = np.empty((self.height, self.width), 'uint8')
-        g = np.empty((self.height, self.width), 'uint8')
-        b = np.empty((self.height, self.width), 'uint8')
-
-        colors = [r, g, b]
-
-        input_buf = cl.Buffer(self.ctx, cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR,
-                              hostbuf=self.height_map.get_map())
-        destination_r = cl.Buffer(self.ctx, cl.mem_flags.WRITE_ONLY, r.nbytes)
-        destination_g = cl.Buffer(self.ctx, cl.mem_flags.WRITE_ONLY, r.nbytes)
-        destination_b = cl.Buffer(self.ctx, cl.mem_flags.WRITE_ONLY, r.nbytes)
-
-        color_buffers = [destination_r, destination_g, destination_b]
-
-        max_height = self.height_map.get_map().max()
-        effective_sea_level = max_height * self._sea_level / 100
-        events = []
-        for color_buf in self._color_buffers:
-            if color_buf.underwater:
-                start = color_buf.start * effective_sea_level / 100
-                end = color_buf.end * effective_sea_level / 100
-            else:
-                start = effective_sea_level + color_buf.start * (max_height-effective_sea_level) / 100
-                end = effective_sea_level + color_buf.end * (max_height - effective_sea_level) / 100
-            e = self.map_tools.ColoredMap(queue, (self.height, self.width), None,
-                                          input_buf,
-                                          destination_r,
-                                          destination_g,
-                                          destination_b,
-                                          np.float32(start),
-                                          np.float32(end),
-                                          np.int32(np.array(color_buf.start_rgb)),
-                                          np.int32(np.array(color_buf.end_rgb)),
-                                          np.int32(self.width),
-                                          np.int32(self.height),
-                                          wait_for=events)
-            events.append(e)
-
-        for i in range(3):
-            cl.enqueue_copy(queue, colors[i], color_buffers[i], wait_for=[events[-1]])
-        b[self.river_map.get_map() > 200] = 255
-
-        self.image = Image.merge("RGB", (
-            Image.fromarray(r, "L"),
-            Image.fromarray(g, "L"),
-            Image.fromarray(b, "L")))
+        statistics = self.height_map.statistics
+        color_ranges = height_ranges(self._color_buffers, self._sea_level, statistics.max)
+        lut = color_lut(color_ranges, statistics.min, statistics.max)
+        effective_sea_level = statistics.max * self._sea_level / 100
+        if self.river_map is None:
+            colors = self.backend.lut_colors(self.height_map.get_data(), lut, statistics.min, statistics.max)
+        else:
+            colors = self.backend.lut_colors(self.height_map.get_data(), lut, statistics.min, statistics.max,
+                                             self.river_map.get_data(), self.river_map.threshold,
+                                             effective_sea_level)
+        self.set_data(colors)
         self.valid = True
 
+    def parameters(self):
+        return super().parameters() + (self._sea_level, LUT_SIZE,
+                                       [(c.start, c.end, c.underwater, list(c.start_rgb), list(c.end_rgb))
+                                        for c in self._color_buffers])
+
+    @staticmethod
+    def to_image(array):
+        # Shares memory with the RGBA host copy instead of copying it
+        array = np.ascontiguousarray(array)
+        return Image.frombuffer("RGBA", (array.shape[1], array.shape[0]), array, "raw", "RGBA", 0, 1)
+
     def handle(self, observable, event: Event):
         super().handle(observable, event)
         if type(event) is SeaLevel:
             self._sea_level = event.sea_level
-            self.notify(Invalidated())
+            self.invalidate()
 
     @classmethod
     def hex_to_rgb4(cls, hex_color):
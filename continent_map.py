@@ -6,31 +6,88 @@ from events import Invalidated, SeaLevel
 from height_map import HeightMap
 from observables import Observable, Event
 
+# One byte per cell in memory, one bit in the layer cache
+LAND_DTYPE = np.uint8
+
 
 class ContinentMap(Map):
     def __init__(self, controller: Observable, width, height, sea_level: int, height_map: HeightMap):
         super().__init__(controller, width, height)
         self._height_map = height_map
         self._sea_level = sea_level
-        self._height_map.subscribe(self)
-        self.generate()
+        self.depends_on(height_map)
+        # Sea level of the current mask, None until there is a mask of the current heights
+        self._mask_sea_level = None
+        # Cells sorted by height, only made once the sea level moves over the same heights
+        self._order = None
+        self._sorted_heights = None
+        self._land_start = 0
 
     def set_sea_level(self, sea_level):
         self._sea_level = sea_level
-        self.notify(Invalidated())
+        self.invalidate()
+
+    def _sea_height(self, sea_level) -> np.float32:
+        # Compared as float32 like the heights on the backend
+        return np.float32(self._height_map.statistics.max * sea_level / 100)
 
     def generate(self):
         if self.valid:
             return
-        self._map = np.zeros_like(self._height_map.get_map())
-        effective_sea_level = self._height_map.get_map().max() * self._sea_level / 100
-
-        self._map[self._height_map.get_map() > effective_sea_level] = 1
+        if self._mask_sea_level is None:
+            # One threshold pass for new heights
+            backend = self._height_map.backend
+            mask = backend.land_mask(self._height_map.get_data(), self._sea_height(self._sea_level))
+            self._map = backend.to_host(mask).reshape(self.height, self.width)
+            backend.release(mask)
+            self.image = None
+        elif self._mask_sea_level != self._sea_level:
+            self._apply_sea_level()
+        self._mask_sea_level = self._sea_level
         self.valid = True
-        self.image = Image.fromarray(self._map, "I")
+
+    def _apply_sea_level(self):
+        # Only the cells between the old and the new sea level change
+        if self._order is None:
+            heights = np.asarray(self._height_map.get_map(), np.float32).ravel()
+            # Land is always a suffix of this order
+            order = np.argsort(heights)
+            self._sorted_heights = heights[order]
+            self._order = order.astype(np.uint32) if heights.size <= np.iinfo(np.uint32).max else order
+            self._land_start = int(np.searchsorted(self._sorted_heights, self._sea_height(self._mask_sea_level),
+                                                   side='right'))
+        land_start = int(np.searchsorted(self._sorted_heights, self._sea_height(self._sea_level), side='right'))
+        cells = self._map.reshape(-1)
+        if land_start < self._land_start:
+            cells[self._order[land_start:self._land_start]] = 1
+        else:
+            cells[self._order[self._land_start:land_start]] = 0
+        self._land_start = land_start
+        self.image = None
+
+    def parameters(self):
+        return super().parameters() + (self._sea_level,)
+
+    @property
+    def cacheable(self):
+        # Moving the sea level over known heights is cheaper than reading the mask from disk
+        return self._order is None
+
+    def dump(self):
+        return np.packbits(self._map > 0, axis=-1)
+
+    def load(self, array):
+        super().load(np.unpackbits(array, axis=-1, count=self.width).view(LAND_DTYPE))
+        self._mask_sea_level = self._sea_level
+
+    @staticmethod
+    def to_image(array):
+        return Image.fromarray(array.astype(np.int32), "I")
 
     def handle(self, observable, event: Event):
+        if observable is self._height_map and type(event) is Invalidated:
+            self._mask_sea_level = None
+            self._order = None
         super().handle(observable, event)
         if type(event) is SeaLevel:
-            self._sea_level = event.sea_level
-            self.notify(Invalidated())
+            self.set_sea_level(event.sea_level)
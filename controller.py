@@ -1,56 +1,198 @@
+import os
 import random
+import threading
+from typing import Callable, Iterator
 
-import pyopencl as cl
 from PIL import Image
 
-from color_map import ColorMap, ColorRange
+from backend import Backend, create_backend
+from color_map import ColorMap, DEFAULT_COLOR_RANGES
+from erosion import Erosion, Progress
 from continent_map import ContinentMap
 from events import Seed, SeaLevel
+from filled_height_map import FilledHeightMap
 from gradient_map import GradientMap
-from height_map import HeightMap
+from height_map import HeightMap, HeightStatistics, ImportedHeightMap
+from imageutils import load_image, save_image
+from lake_depth_map import LakeDepthMap
+from lake_map import LakeMap
+from layer_cache import LayerCache
 from maptypes import MapTypes
 from mean_height_map import MeanHeightMap
 from observables import Observable
+from regions import REGION_LAYERS, RegionRenderer
 from river_map import RiverMap
+from slope_map import SlopeMap
+from scheduler import LayerScheduler
+from tiles import Window
+
+# Fractions of the resolution shown before a full resolution map, coarsest first
+PREVIEW_STEPS = (8, 4)
+# Class of every layer, their to_image makes images of host arrays made without a controller
+LAYER_CLASSES = {
+    MapTypes.HEIGHT_MAP: HeightMap,
+    MapTypes.RIVER_MAP: RiverMap,
+    MapTypes.COLOR_MAP: ColorMap,
+    MapTypes.CONTINENT_MAP: ContinentMap,
+    MapTypes.MEAN_HEIGHT_MAP: MeanHeightMap,
+    MapTypes.GRADIENT_MAP: GradientMap,
+    MapTypes.SLOPE_MAP: SlopeMap,
+    MapTypes.FILLED_HEIGHT_MAP: FilledHeightMap,
+    MapTypes.LAKE_MAP: LakeMap,
+    MapTypes.LAKE_DEPTH_MAP: LakeDepthMap,
+}
 
 
 class Controller(Observable):
-    def __init__(self, width, height, filters, sea_level, seed=random.randint(1, 100000)):
+    def __init__(self, width, height, filters, sea_level, seed=random.randint(1, 100000), backend: Backend = None,
+                 mean_radius=30, river_threshold=500, cache: LayerCache = None, step=1, height_source: str = None,
+                 height_dtype: str = 'float32', erosion: Erosion = None, fill_depressions: bool = False):
         super().__init__()
-        self.ctx = cl.create_some_context(interactive=False)
+        self.backend = backend if backend is not None else create_backend()
+        self.height_source = height_source
+        heights = None
+        if height_source is not None:
+            # Width and height are only needed for raw files, which are checked against them
+            heights = load_image(height_source, width, height)
+            height, width = heights.shape
         self.width = width
         self.height = height
+        self.filters = filters
         self.seed = seed
         self.sea_level = sea_level
-        height_map = HeightMap(self, self.width, self.height, self.ctx, filters, self.seed)
-        mean_height_map = MeanHeightMap(self, self.width, self.height, self.ctx, height_map)
-        gradient_map = GradientMap(self, self.width, self.height, self.ctx, mean_height_map)
-        continent_map = ContinentMap(self, self.width, self.height, self.sea_level, height_map)
-        river_map = RiverMap(self, self.width, self.height, self.ctx, gradient_map, continent_map)
+        self.mean_radius = mean_radius
+        self.river_threshold = river_threshold
+        self.cache = cache
+        self.step = step
+        self.height_dtype = height_dtype
+        self.erosion = erosion if erosion is not None and erosion.enabled else None
+        # Rivers routed across filled depressions, the flood runs on the host and costs more than the other layers
+        self.fill_depressions = fill_depressions
+        self.erosion_progress: Progress = None
+        self.scheduler = LayerScheduler(cache=cache, profiler=self.backend.profiler,
+                                        name="1/{} ".format(step) if step > 1 else "")
+        self._previews = {}
+        self.imported_heights = heights
+        self._regions = None
+        # Requests from several threads, the tile server for example, generate every layer once
+        self._lock = threading.RLock()
+
+        # Maps of a preview have one cell for every step x step cells of the world
+        window = Window.full(width, height, step)
+        map_width, map_height = window.width, window.height
+        map_erosion = self.erosion.scaled(step) if self.erosion is not None else None
+        if heights is not None:
+            status = os.stat(height_source)
+            source = "{}:{}:{}".format(os.path.abspath(height_source), status.st_size, status.st_mtime_ns)
+            height_map = ImportedHeightMap(self, self.backend, heights, source, step, height_dtype, map_erosion)
+        else:
+            height_map = HeightMap(self, map_width, map_height, self.backend, filters, self.seed, window, height_dtype,
+                                   map_erosion)
+        mean_height_map = MeanHeightMap(self, map_width, map_height, self.backend, height_map, mean_radius)
+        gradient_map = GradientMap(self, map_width, map_height, self.backend, mean_height_map)
+        continent_map = ContinentMap(self, map_width, map_height, self.sea_level, height_map)
+        filled_height_map = FilledHeightMap(self, map_width, map_height, mean_height_map)
+        lake_map = LakeMap(self, map_width, map_height, filled_height_map, continent_map)
+        river_map = RiverMap(self, map_width, map_height, self.backend, gradient_map, continent_map,
+                             filled_height_map if fill_depressions else None, river_threshold)
 
         self._maps = {
             MapTypes.HEIGHT_MAP: height_map,
             MapTypes.RIVER_MAP: river_map,
-            MapTypes.COLOR_MAP: ColorMap(self, self.width, self.height, self.ctx, height_map, river_map, sea_level,
-                                         [ColorRange(0, 100, True, [30, 80, 160, 0], [91, 154, 255, 0]),
-                                          ColorRange(0, 30, False, [255, 243, 114, 0], [76, 211, 27, 0]),
-                                          ColorRange(30, 80, False, [119, 255, 73, 0], [55, 122, 33, 0]),
-                                          ColorRange(80, 100, False, [255, 240, 220, 0], [255, 211, 240, 0])
-                                          ]),
+            # Previews leave the rivers out of the colors, flow accumulation would dominate their cost
+            MapTypes.COLOR_MAP: ColorMap(self, map_width, map_height, self.backend, height_map,
+                                         river_map if step == 1 else None, sea_level, DEFAULT_COLOR_RANGES),
             MapTypes.CONTINENT_MAP: continent_map,
             MapTypes.MEAN_HEIGHT_MAP: mean_height_map,
             MapTypes.GRADIENT_MAP: gradient_map,
+            MapTypes.SLOPE_MAP: SlopeMap(self, map_width, map_height, self.backend, gradient_map),
+            MapTypes.FILLED_HEIGHT_MAP: filled_height_map,
+            MapTypes.LAKE_MAP: lake_map,
+            MapTypes.LAKE_DEPTH_MAP: LakeDepthMap(self, map_width, map_height, lake_map),
         }
 
-    def get_map_image(self, map_type: MapTypes) -> Image:
+    def preview(self, step: int) -> 'Controller':
+        with self._lock:
+            return self._preview(step)
+
+    def _preview(self, step: int) -> 'Controller':
+        if step not in self._previews:
+            self._previews[step] = Controller(self.width, self.height, self.filters, self.sea_level, self.seed,
+                                              self.backend, max(1, self.mean_radius // step),
+                                              max(1, self.river_threshold // (step * step)), self.cache, step,
+                                              self.height_source, self.height_dtype, self.erosion,
+                                              self.fill_depressions)
+            self._previews[step].set_erosion_progress(self.erosion_progress)
+        return self._previews[step]
+
+    def update(self, *map_types: MapTypes, cancelled: Callable[[], bool] = None) -> None:
+        if MapTypes.SLOPE_MAP in map_types:
+            # From now on slopes come out of the gradient pass instead of a pass of their own
+            self._maps[MapTypes.GRADIENT_MAP].keep_slope = True
+        with self._lock:
+            self.scheduler.update(*[self._maps[map_type] for map_type in map_types], cancelled=cancelled)
+
+    @property
+    def statistics(self) -> HeightStatistics:
+        self.update(MapTypes.HEIGHT_MAP)
+        return self._maps[MapTypes.HEIGHT_MAP].statistics
+
+    def get_map(self, map_type: MapTypes, cancelled: Callable[[], bool] = None):
+        # Host array of the layer, waits for the device to finish it
+        self.update(map_type, cancelled=cancelled)
+        return self._maps[map_type].get_map()
+
+    def get_map_image(self, map_type: MapTypes, cancelled: Callable[[], bool] = None) -> Image:
+        self.update(map_type, cancelled=cancelled)
         return self._maps[map_type].get_image()
 
+    def export(self, map_type: MapTypes, filename: str, **kwargs) -> None:
+        # Format by extension, see imageutils.save_image
+        self.update(map_type)
+        save_image(self._maps[map_type].get_map(), filename, **kwargs)
+
+    def progressive_images(self, map_type: MapTypes, cancelled: Callable[[], bool] = None) -> Iterator[Image]:
+        # Coarse previews scaled to the full size first when the heights have to be generated again
+        if not self._maps[MapTypes.HEIGHT_MAP].valid:
+            for step in PREVIEW_STEPS:
+                image = self.preview(step).get_map_image(map_type, cancelled)
+                yield image.resize((self.width, self.height), Image.NEAREST)
+        yield self.get_map_image(map_type, cancelled)
+
+    def is_generated(self, map_type: MapTypes) -> bool:
+        return self._maps[map_type].valid
+
+    def get_region(self, map_type: MapTypes, x0: int, y0: int, width: int, height: int, scale: int = 1) -> Image:
+        # Every scale-th cell of a rectangle of the world, see regions.RegionRenderer
+        if map_type not in REGION_LAYERS or self.erosion is not None:
+            # Rivers, lakes and erosion need the whole map, crop it at the same scale instead
+            controller = self if scale == 1 else self.preview(scale)
+            rows = slice(max(0, y0) // scale, -(-min(y0 + height, self.height) // scale))
+            columns = slice(max(0, x0) // scale, -(-min(x0 + width, self.width) // scale))
+            controller.update(map_type)
+            return controller._maps[map_type].to_image(controller._maps[map_type].get_map()[rows, columns])
+        with self._lock:
+            if self._regions is None:
+                self._regions = RegionRenderer(self)
+        return self._maps[map_type].to_image(self._regions.region(map_type, x0, y0, width, height, scale))
+
+    def set_erosion_progress(self, progress: Progress) -> None:
+        # Hook of the erosion of this map and its previews, see erosion.Progress
+        self.erosion_progress = progress
+        self._maps[MapTypes.HEIGHT_MAP].progress = progress
+        for preview in self._previews.values():
+            preview.set_erosion_progress(progress)
+
     def set_seed(self, seed):
         if seed != self.seed:
             self.seed = seed
             self.notify(Seed(seed))
+            for preview in self._previews.values():
+                preview.set_seed(seed)
 
     def set_sea_level(self, sea_level):
         if sea_level != self.sea_level:
             self.sea_level = sea_level
             self.notify(SeaLevel(sea_level))
+            for preview in self._previews.values():
+                preview.set_sea_level(sea_level)
@@ -0,0 +1,112 @@
+import numpy as np
+
+from numpy_backend import DIRECTION_DX, DIRECTION_DY
+
+# Height levels of the flood, the filled surface is exact to within one level of the height range
+FLOOD_LEVELS = 4096
+# Cells routed at once, bounds the temporaries of route
+CHUNK_CELLS = 1 << 22
+
+
+def _outward(height: int, width: int, cells: np.ndarray) -> np.ndarray:
+    # Direction codes leaving the map from border cells
+    y, x = np.divmod(cells, width)
+    codes = np.full(cells.shape, 4, np.uint8)
+    codes[y == height - 1] = 0
+    codes[x == 0] = 6
+    codes[x == width - 1] = 2
+    return codes
+
+
+def priority_flood(surface: np.ndarray, levels: int = FLOOD_LEVELS):
+    """Fills every depression of surface up to its spill height, flooding inwards from the border.
+
+    Heights are put in levels buckets and flooded bucket by bucket, each bucket a breadth first search over whole
+    frontiers at once, so the work is linear in the number of cells. Returns the filled surface and, for every
+    cell, the direction code towards the neighbour it was flooded from, which leads off the map through cells
+    that are never higher.
+    """
+    height, width = surface.shape
+    heights = np.ascontiguousarray(surface, np.float32).ravel()
+    index_dtype = np.int32 if heights.size < np.iinfo(np.int32).max else np.int64
+    low, high = float(heights.min()), float(heights.max())
+    scale = (levels - 1) / (high - low) if high > low else 0.0
+    buckets = ((heights - np.float32(low)) * np.float32(scale)).astype(np.uint16 if levels <= 1 << 16 else np.int32)
+    filled = np.empty(heights.size, np.float32)
+    parents = np.empty(heights.size, np.uint8)
+    # 0 unseen, 1 waiting in a bucket, 2 flooded
+    state = np.zeros(heights.size, np.uint8)
+    queue = [[] for _ in range(levels)]
+
+    def push(cells):
+        state[cells] = 1
+        cell_buckets = buckets[cells]
+        first = cell_buckets.min()
+        if first == cell_buckets.max():
+            queue[first].append(cells)
+            return
+        order = np.argsort(cell_buckets, kind='stable')
+        cells = cells[order]
+        bucket_levels, starts = np.unique(cell_buckets[order], return_index=True)
+        for level, part in zip(bucket_levels, np.split(cells, starts[1:])):
+            queue[level].append(part)
+
+    rows = np.arange(height, dtype=index_dtype)
+    columns = np.arange(width, dtype=index_dtype)
+    border = np.unique(np.concatenate([columns, (height - 1) * width + columns, rows * width,
+                                       rows * width + width - 1]))
+    filled[border] = heights[border]
+    parents[border] = _outward(height, width, border)
+    push(border)
+
+    dx = DIRECTION_DX.astype(index_dtype)
+    dy = DIRECTION_DY.astype(index_dtype)
+    # A neighbour in direction code drains back the opposite way
+    opposite = ((np.arange(8) + 4) % 8).astype(np.uint8)
+    for level in range(levels):
+        if not queue[level]:
+            continue
+        frontier = np.concatenate(queue[level])
+        queue[level] = None
+        state[frontier] = 2
+        while frontier.size:
+            y, x = np.divmod(frontier, width)
+            nx = x[:, np.newaxis] + dx
+            ny = y[:, np.newaxis] + dy
+            inside = (nx >= 0) & (nx < width) & (ny >= 0) & (ny < height)
+            neighbours = np.where(inside, ny * width + nx, 0)
+            source, code = np.nonzero(inside & (state[neighbours] == 0))
+            cells, first = np.unique(neighbours[source, code], return_index=True)
+            source = frontier[source[first]]
+            filled[cells] = np.maximum(heights[cells], filled[source])
+            parents[cells] = opposite[code[first]]
+            # Cells up to this level, the depressions behind them included, are flooded now, higher ones wait
+            now = buckets[cells] <= level
+            frontier = cells[now]
+            state[frontier] = 2
+            if frontier.size < cells.size:
+                push(cells[~now])
+    return filled.reshape(height, width), parents.reshape(height, width)
+
+
+def route(directions: np.ndarray, filled: np.ndarray, parents: np.ndarray) -> np.ndarray:
+    """Directions that always drain off the map.
+
+    A direction is kept where it leaves the map or descends the filled surface, elsewhere, in lakes and on
+    their rims, the cell drains towards the neighbour it was flooded from.
+    """
+    height, width = directions.shape
+    result = np.empty_like(directions)
+    flat_filled = filled.ravel()
+    rows = max(1, CHUNK_CELLS // width)
+    x = np.arange(width, dtype=np.int64)
+    for y0 in range(0, height, rows):
+        y1 = min(height, y0 + rows)
+        band = directions[y0:y1]
+        tx = x + DIRECTION_DX[band]
+        ty = np.arange(y0, y1, dtype=np.int64)[:, np.newaxis] + DIRECTION_DY[band]
+        inside = (tx >= 0) & (tx < width) & (ty >= 0) & (ty < height)
+        target = np.where(inside, ty * width + tx, 0)
+        keep = ~inside | (flat_filled[target] < filled[y0:y1])
+        result[y0:y1] = np.where(keep, band, parents[y0:y1])
+    return result
@@ -0,0 +1,139 @@
+// Grid based hydraulic and thermal erosion, one launch per step and iteration. Every kernel reads the buffers of
+// the last step and writes the other buffer of a pair, the host only swaps them between launches.
+// Outflow fluxes are float4 of the left, right, upper and lower neighbour, nothing flows out of the map.
+
+#define GRAVITY 9.81f
+#define MIN_DEPTH 1e-4f
+
+
+// New outflow fluxes from the water surface differences to the neighbours, scaled down where they would take
+// more water than the cell has
+__kernel void erosion_flux(
+    __global const float*   terrain,
+    __global const float*   water,
+    __global const float4*  flux,
+    __global float4*        flux_out,
+                   float    rain,
+                   float    dt,
+                   int      width,
+                   int      height) {
+    int x = get_global_id(1);
+    int y = get_global_id(0);
+    int i = x + y * width;
+
+    // Water holds what was left after the last step, both water kernels add the rain of this one
+    float depth = water[i] + rain * dt;
+    float surface = terrain[i] + water[i];
+    float4 f = flux[i] + dt * GRAVITY * (float4)(
+        x > 0 ? surface - terrain[i - 1] - water[i - 1] : 0.0f,
+        x < width - 1 ? surface - terrain[i + 1] - water[i + 1] : 0.0f,
+        y > 0 ? surface - terrain[i - width] - water[i - width] : 0.0f,
+        y < height - 1 ? surface - terrain[i + width] - water[i + width] : 0.0f);
+    f = fmax(f, 0.0f);
+    if (x == 0) f.s0 = 0.0f;
+    if (x == width - 1) f.s1 = 0.0f;
+    if (y == 0) f.s2 = 0.0f;
+    if (y == height - 1) f.s3 = 0.0f;
+    float total = (f.s0 + f.s1 + f.s2 + f.s3) * dt;
+    flux_out[i] = total > depth ? f * (depth / total) : f;
+}
+
+
+// Moves the water and the sediment in it along the fluxes, then dissolves terrain into the water or deposits
+// sediment from it, depending on how much sediment the water can carry at its speed down the local slope
+__kernel void erosion_water(
+    __global const float*   terrain,
+    __global const float*   water,
+    __global const float*   sediment,
+    __global const float4*  flux,
+    __global float*         terrain_out,
+    __global float*         water_out,
+    __global float*         sediment_out,
+                   float    rain,
+                   float    dt,
+                   float    evaporation,
+                   float    capacity,
+                   float    dissolving,
+                   float    deposition,
+                   float    min_tilt,
+                   int      width,
+                   int      height) {
+    int x = get_global_id(1);
+    int y = get_global_id(0);
+    int i = x + y * width;
+
+    float4 f = flux[i];
+    float from_left = x > 0 ? flux[i - 1].s1 : 0.0f;
+    float from_right = x < width - 1 ? flux[i + 1].s0 : 0.0f;
+    float from_up = y > 0 ? flux[i - width].s3 : 0.0f;
+    float from_down = y < height - 1 ? flux[i + width].s2 : 0.0f;
+    float outflow = f.s0 + f.s1 + f.s2 + f.s3;
+
+    float depth = water[i] + rain * dt;
+    float new_depth = fmax(depth + dt * (from_left + from_right + from_up + from_down - outflow), 0.0f);
+    float mean_depth = (depth + new_depth) * 0.5f;
+    float2 v = mean_depth > MIN_DEPTH ?
+        (float2)(from_left - f.s0 + f.s1 - from_right, from_up - f.s2 + f.s3 - from_down) * 0.5f / mean_depth :
+        (float2)(0.0f, 0.0f);
+
+    // Sediment leaves with the same share of the water as the water, sender and receiver compute the same amount
+    float s = sediment[i] * (1.0f - outflow * dt / fmax(depth, MIN_DEPTH));
+    if (x > 0) s += sediment[i - 1] * from_left * dt / fmax(water[i - 1] + rain * dt, MIN_DEPTH);
+    if (x < width - 1) s += sediment[i + 1] * from_right * dt / fmax(water[i + 1] + rain * dt, MIN_DEPTH);
+    if (y > 0) s += sediment[i - width] * from_up * dt / fmax(water[i - width] + rain * dt, MIN_DEPTH);
+    if (y < height - 1) s += sediment[i + width] * from_down * dt / fmax(water[i + width] + rain * dt, MIN_DEPTH);
+
+    float h = terrain[i];
+    float gx = (terrain[y * width + min(x + 1, width - 1)] - terrain[y * width + max(x - 1, 0)]) * 0.5f;
+    float gy = (terrain[min(y + 1, height - 1) * width + x] - terrain[max(y - 1, 0) * width + x]) * 0.5f;
+    float tilt = sqrt(gx * gx + gy * gy);
+    tilt = tilt / sqrt(1.0f + tilt * tilt);
+    // Shallow water carries little whatever its speed
+    float carried = capacity * fmax(tilt, min_tilt) * length(v) * new_depth;
+    float amount = carried > s ? dissolving * (carried - s) : -deposition * (s - carried);
+    terrain_out[i] = h - amount;
+    sediment_out[i] = s + amount;
+    water_out[i] = new_depth * (1.0f - evaporation * dt);
+}
+
+
+// Material exchanged with all eight neighbours where the height difference is above the talus, both cells of a
+// pair compute the same amount so nothing is lost
+__kernel void thermal_erosion(
+    __global const float*   terrain,
+    __global float*         terrain_out,
+                   float    talus,
+                   float    rate,
+                   int      width,
+                   int      height) {
+    int x = get_global_id(1);
+    int y = get_global_id(0);
+    int i = x + y * width;
+
+    float h = terrain[i];
+    float change = 0.0f;
+    for (int dy = -1; dy <= 1; dy++) {
+        for (int dx = -1; dx <= 1; dx++) {
+            int nx = x + dx;
+            int ny = y + dy;
+            if ((dx == 0 && dy == 0) || nx < 0 || nx >= width || ny < 0 || ny >= height) {
+                continue;
+            }
+            float limit = dx != 0 && dy != 0 ? talus * M_SQRT2_F : talus;
+            float difference = terrain[ny * width + nx] - h;
+            change += fmax(difference - limit, 0.0f) - fmax(-difference - limit, 0.0f);
+        }
+    }
+    // At most half of the excess over the talus moves, split between the neighbours
+    terrain_out[i] = h + change * rate * 0.0625f;
+}
+
+
+// Suspended sediment settles where it is when the erosion ends
+__kernel void erosion_settle(
+    __global const float*   terrain,
+    __global const float*   sediment,
+    __global float*         output) {
+    int i = get_global_id(0);
+    output[i] = terrain[i] + sediment[i];
+}
@@ -0,0 +1,63 @@
+import copy
+from typing import Callable, Optional
+
+# Iterations between two calls of the progress hook
+PROGRESS_INTERVAL = 16
+GRAVITY = 9.81
+# Water depth below which cells have no flow velocity
+MIN_DEPTH = 1e-4
+
+# progress(done, total) is called every PROGRESS_INTERVAL iterations and after the last one, returning False stops
+# the erosion with the heights reached so far, raising aborts it
+Progress = Optional[Callable[[int, int], bool]]
+
+
+class Erosion:
+    """Settings of the erosion run on height maps after they are generated.
+
+    Every iteration is one time step of grid based hydraulic erosion, rain flowing between neighbouring cells through
+    virtual pipes and carrying sediment with it, followed by thermal erosion, which moves material down slopes
+    steeper than talus height units per cell. rain 0 leaves out the hydraulic part, thermal_rate 0 the thermal one.
+    """
+
+    def __init__(self, iterations: int = 0, rain: float = 0.01, talus: float = 1.0, thermal_rate: float = 0.5,
+                 evaporation: float = 0.5, capacity: float = 1.0, dissolving: float = 0.3, deposition: float = 0.3,
+                 min_tilt: float = 0.05, time_step: float = 0.05):
+        self.iterations = iterations
+        self.rain = rain
+        self.talus = talus
+        self.thermal_rate = thermal_rate
+        self.evaporation = evaporation
+        self.capacity = capacity
+        self.dissolving = dissolving
+        self.deposition = deposition
+        self.min_tilt = min_tilt
+        self.time_step = time_step
+
+    @property
+    def hydraulic(self) -> bool:
+        return self.rain > 0
+
+    @property
+    def thermal(self) -> bool:
+        return self.thermal_rate > 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.iterations > 0 and (self.hydraulic or self.thermal)
+
+    def scaled(self, step: int) -> 'Erosion':
+        # Settings for maps with one cell for every step x step cells of the world, where the same slopes rise
+        # step times more per cell
+        scaled = copy.copy(self)
+        scaled.talus = self.talus * step
+        return scaled
+
+    def parameters(self) -> tuple:
+        return (self.iterations, self.rain, self.talus, self.thermal_rate, self.evaporation, self.capacity,
+                self.dissolving, self.deposition, self.min_tilt, self.time_step)
+
+
+def proceed(progress: Progress, done: int, total: int) -> bool:
+    # False once the hook asks to stop
+    return progress is None or progress(done, total) is not False
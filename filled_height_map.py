@@ -0,0 +1,41 @@
+import numpy as np
+from PIL import Image
+
+from base_maps import Map
+from depressions import FLOOD_LEVELS, priority_flood
+from mean_height_map import MeanHeightMap
+from observables import Observable
+
+
+class FilledHeightMap(Map):
+    """Mean heights with every depression filled up to where it spills over, the surface rivers are routed on."""
+
+    def __init__(self, controller: Observable, width, height, mean_height_map: MeanHeightMap):
+        super().__init__(controller, width, height)
+        self.mean_height_map = mean_height_map
+        self.depends_on(mean_height_map)
+        # Direction from every cell towards the neighbour it was flooded from
+        self.parents = None
+
+    def generate(self):
+        if self.valid:
+            return
+        self._map, self.parents = priority_flood(self.mean_height_map.get_map())
+        self.image = None
+        self.valid = True
+
+    def parameters(self):
+        return super().parameters() + (FLOOD_LEVELS,)
+
+    def dump(self):
+        # Filled heights followed by the flood directions, as bytes
+        return np.concatenate([self._map.view(np.uint8).ravel(), self.parents.ravel()])
+
+    def load(self, array):
+        cells = self.width * self.height
+        self.parents = array[4 * cells:].reshape(self.height, self.width)
+        super().load(array[:4 * cells].view(np.float32).reshape(self.height, self.width))
+
+    @staticmethod
+    def to_image(array):
+        return Image.fromarray(array, "F")
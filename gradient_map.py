@@ -1,36 +1,39 @@
-import numpy as np
-import pyopencl as cl
 from PIL import Image
 
-from base_maps import CLMap
+from backend import Backend
+from base_maps import BackendMap
 from mean_height_map import MeanHeightMap
 from observables import Observable
 
 
-class GradientMap(CLMap):
-    def __init__(self, controller: Observable, width, height, ctx, mean_height_map: MeanHeightMap):
-        super().__init__(controller, width, height, ctx)
+class GradientMap(BackendMap):
+    def __init__(self, controller: Observable, width, height, backend: Backend, mean_height_map: MeanHeightMap):
+        super().__init__(controller, width, height, backend)
         self.mean_height_map = mean_height_map
-        self.map_tools = cl.Program(self.ctx, open("maptools.cl").read()).build()
-        self.generate()
+        self.depends_on(mean_height_map)
+        # Set once slopes are wanted, they are then made in the same pass as the directions
+        self.keep_slope = False
+        self._slope = None
 
     def generate(self):
         if self.valid:
             return
-        if not self.mean_height_map.valid:
-            self.mean_height_map.generate()
-        gradients = np.gradient(self.mean_height_map.get_map())
-        self._map = np.empty((self.height, self.width), np.uint8)
+        directions, slope = self.backend.gradient_directions(self.mean_height_map.get_data(), self.keep_slope)
+        self.set_data(directions)
+        self._set_slope(slope)
+        self.valid = True
 
-        queue = cl.CommandQueue(self.ctx)
-        y_buf = cl.Buffer(self.ctx, cl.mem_flags.COPY_HOST_PTR, hostbuf=gradients[0])
-        x_buf = cl.Buffer(self.ctx, cl.mem_flags.COPY_HOST_PTR, hostbuf=gradients[1])
-        output_buf = cl.Buffer(self.ctx, cl.mem_flags.WRITE_ONLY, size=self._map.nbytes)
+    def _set_slope(self, slope):
+        if self._slope is not None:
+            self.backend.release(self._slope)
+        self._slope = slope
 
-        event = self.map_tools.gradient_direction(queue, self._map.shape, None,
-                                                  x_buf,
-                                                  y_buf,
-                                                  output_buf,
-                                                  np.int32(self.width))
-        cl.enqueue_copy(queue, self._map, output_buf, wait_for=[event])
-        self.image = Image.fromarray(self._map * 35, 'P')
+    def take_slope(self):
+        # Slope made along with the current directions, None when they were not generated with it
+        slope = self._slope if self.valid else None
+        self._slope = None
+        return slope
+
+    @staticmethod
+    def to_image(array):
+        return Image.fromarray(array * 35, 'P')
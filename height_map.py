@@ -1,46 +1,173 @@
 from random import Random
 
 import numpy as np
-import pyopencl as cl
 from PIL import Image
 
-from base_maps import CLMap
-from events import Invalidated, Seed
-from height_map_filter import HeightMapFilter
+from backend import Backend
+from base_maps import BackendMap
+from erosion import Erosion, Progress, proceed
+from events import Seed
 from observables import Observable, Event
+from tiles import Window
 
+# Host and cache types of height maps, the device always computes in float32
+HEIGHT_DTYPES = ('float32', 'float16')
 
-class HeightMap(CLMap):
-    def __init__(self, controller: Observable, width, height, context, filters, seed=10000):
-        super().__init__(controller, width, height, context)
+
+def octaves(seed, filters):
+    random = Random(seed)
+    return [(random.randint(0, 1000000), f.scale, f.effect) for f in filters]
+
+
+class HeightStatistics:
+    """Summary of one generated height map, kept until the heights change."""
+
+    def __init__(self, height_map: 'HeightMap', bins: int = 1024):
+        self._height_map = height_map
+        self.min, self.max = height_map.backend.min_max(height_map.get_data())
+        self.bins = bins
+        self._histogram = None
+
+    @property
+    def histogram(self) -> np.ndarray:
+        if self._histogram is None:
+            self._histogram = np.histogram(self._height_map.get_map(), self.bins, (self.min, self.max))[0]
+        return self._histogram
+
+    def fraction_below(self, height: float) -> float:
+        # Linear within the histogram bin that contains the height
+        if height <= self.min:
+            return 0.0
+        if height >= self.max:
+            return 1.0
+        position = (height - self.min) / (self.max - self.min) * self.bins
+        index = int(position)
+        below = self.histogram[:index].sum() + self.histogram[index] * (position - index)
+        return float(below / self.histogram.sum())
+
+    def land_fraction(self, sea_level: float) -> float:
+        return 1 - self.fraction_below(self.max * sea_level / 100)
+
+
+class HeightMap(BackendMap):
+    def __init__(self, controller: Observable, width, height, backend: Backend, filters, seed=10000,
+                 window: Window = None, dtype: str = 'float32', erosion: Erosion = None):
+        super().__init__(controller, width, height, backend)
         self.filters = filters
         self.seed = seed
-        self.noise = cl.Program(self.ctx, open("noise/Noise.cl").read()).build()
-        self.valid = False
-        self.generate()
+        self.window = window or Window.full(width, height)
+        self.dtype = np.dtype(dtype)
+        self.erosion = erosion if erosion is not None and erosion.enabled else None
+        # Hook of the erosion, see erosion.Progress
+        self.progress: Progress = None
+        # False when the progress hook stopped the erosion early
+        self._complete = True
+        self._statistics = None
 
     def generate(self):
         if self.valid:
             return
-        random = Random(self.seed)
-        queue = cl.CommandQueue(self.ctx)
-        self._map = np.empty((self.height, self.width), np.float32)
-        destination_buf = cl.Buffer(self.ctx, cl.mem_flags.HOST_READ_ONLY | cl.mem_flags.COPY_HOST_PTR,
-                                    hostbuf=np.full(self._map.size, 127.5, np.float32))
-        events = []
-        for f in self.filters:
-            events.append(self.noise.HeightMap(queue, self._map.shape, None, destination_buf,
-                                               np.int32(self.width), np.int32(self.height),
-                                               np.int32(random.randint(0, 1000000)),
-                                               np.float32(f.scale), np.float32(f.effect), wait_for=events))
-        cl.enqueue_copy(queue, self._map, destination_buf, wait_for=events)
-        self._map = HeightMapFilter(self.ctx).run_filter(self._map)
-
-        self.image = Image.fromarray(self._map, "F")
+        self._set_heights(self.backend.height_map(self.window, octaves(self.seed, self.filters)))
+
+    def _set_heights(self, data):
+        if self.erosion is not None:
+            data = self._erode(data)
+        if self.dtype != np.float32:
+            # Later stages see the same rounded heights as after loading them from the layer cache
+            host = self.backend.to_host(data).astype(self.dtype)
+            self.backend.release(data)
+            data = self.backend.to_device(host.astype(np.float32))
+        self.set_data(data)
         self.valid = True
+        # Created here so layers generated concurrently never race to create them
+        self._statistics = HeightStatistics(self)
+
+    def _erode(self, data):
+        stopped = []
+
+        def progress(done, total):
+            if proceed(self.progress, done, total):
+                return True
+            stopped.append(done)
+            return False
+
+        try:
+            eroded = self.backend.erode(data, self.erosion, progress)
+        finally:
+            self.backend.release(data)
+        self._complete = not stopped
+        return eroded
+
+    def _erosion_parameters(self) -> tuple:
+        # Nothing for maps that are not eroded, their keys stay the same as before erosion existed
+        return (self.erosion.parameters(),) if self.erosion is not None else ()
+
+    @property
+    def complete(self) -> bool:
+        return self._complete
+
+    def invalidate(self):
+        self._complete = True
+        super().invalidate()
+
+    def parameters(self):
+        return super().parameters() + (self.seed, [(f.scale, f.effect) for f in self.filters], tuple(self.window),
+                                       self.dtype.name) + self._erosion_parameters()
+
+    def to_host(self):
+        return self.backend.to_host(self._data).astype(self.dtype, copy=False)
+
+    def dump(self):
+        return self.get_map()
+
+    def load(self, array):
+        super().load(np.asarray(array, np.float32))
+        self._statistics = HeightStatistics(self)
+
+    def set_data(self, data):
+        super().set_data(data)
+        self._statistics = None
+
+    @property
+    def statistics(self) -> HeightStatistics:
+        if not self.valid:
+            self.generate()
+        return self._statistics
+
+    @staticmethod
+    def to_image(array):
+        return Image.fromarray(np.asarray(array, np.float32), "F")
 
     def handle(self, observable, event: Event):
         super().handle(observable, event)
         if type(event) is Seed:
             self.seed = event.seed
-            self.notify(Invalidated())
+            self.invalidate()
+
+
+class ImportedHeightMap(HeightMap):
+    """Heights read from a file instead of generated, seeds do not change them.
+
+    source identifies the file contents in the layer cache, the path with its size and modification time for example.
+    """
+
+    def __init__(self, controller: Observable, backend: Backend, heights: np.ndarray, source: str, step: int = 1,
+                 dtype: str = 'float32', erosion: Erosion = None):
+        window = Window.full(heights.shape[1], heights.shape[0], step)
+        super().__init__(controller, window.width, window.height, backend, [], None, window, dtype, erosion)
+        self.heights = heights
+        self.source = source
+
+    def generate(self):
+        if self.valid:
+            return
+        step = self.window.step
+        self._set_heights(self.backend.to_device(np.asarray(self.heights[::step, ::step], np.float32)))
+
+    def parameters(self):
+        return (self.width, self.height, self.backend.name, self.source, tuple(self.window),
+                self.dtype.name) + self._erosion_parameters()
+
+    def handle(self, observable, event: Event):
+        if type(event) is not Seed:
+            super().handle(observable, event)
@@ -1,6 +1,129 @@
-def load_image(filename):
-    pass
+import os
+import struct
+import zlib
 
+import numpy as np
+from PIL import Image
 
-def save_image(np_2d_array, filename):
-    pass
+# Rows copied or compressed at once, keeps memory use flat for maps of any size
+CHUNK_BYTES = 1 << 24
+
+RAW_DTYPES = {".raw": np.float32, ".r32": np.float32, ".r16": np.uint16}
+PNG_MODES = {1: 0, 3: 2, 4: 6}
+
+
+def _chunk_rows(array: np.ndarray) -> int:
+    return max(1, CHUNK_BYTES // max(1, array[0].nbytes))
+
+
+def _to_dtype(rows: np.ndarray, dtype, low: float, high: float) -> np.ndarray:
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'u' and rows.dtype.kind == 'f':
+        # Heights scaled to the whole integer range, the usual layout of 16 bit engine heightmaps
+        scale = np.iinfo(dtype).max / (high - low) if high > low else 0.0
+        return np.clip(np.rint((np.asarray(rows, np.float32) - low) * scale), 0, np.iinfo(dtype).max).astype(dtype)
+    return rows.astype(dtype, copy=False)
+
+
+def _copy_rows(source: np.ndarray, destination: np.ndarray, low=None, high=None):
+    if destination.dtype.kind == 'u' and source.dtype.kind == 'f' and (low is None or high is None):
+        low, high = float(source.min()), float(source.max())
+    rows = _chunk_rows(source)
+    for y in range(0, source.shape[0], rows):
+        destination[y:y + rows] = _to_dtype(np.asarray(source[y:y + rows]), destination.dtype, low, high)
+    destination.flush()
+
+
+def save_raw(array: np.ndarray, filename: str, dtype=np.float32, low: float = None, high: float = None):
+    """Headerless little endian samples, row by row. Float heights saved as integers are scaled from low...high."""
+    output = np.memmap(filename, np.dtype(dtype).newbyteorder('<'), 'w+', shape=array.shape)
+    _copy_rows(array, output, low, high)
+    del output
+
+
+def save_npy(array: np.ndarray, filename: str, dtype=None, low: float = None, high: float = None):
+    output = np.lib.format.open_memmap(filename, 'w+', dtype or array.dtype, array.shape)
+    _copy_rows(array, output, low, high)
+    del output
+
+
+def _png_chunk(f, kind: bytes, data: bytes):
+    f.write(struct.pack(">I", len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)) & 0xffffffff))
+
+
+def save_png(array: np.ndarray, filename: str, compression: int = 6, low: float = None, high: float = None):
+    """Writes (height, width[, channels]) arrays a few rows at a time, for images too big for PIL.
+
+    Float heights become 16 bit grayscale scaled from low...high.
+    """
+    channels = array.shape[2] if array.ndim == 3 else 1
+    dtype = np.dtype(np.uint16) if array.dtype.kind == 'f' else array.dtype
+    if channels not in PNG_MODES or dtype not in (np.uint8, np.uint16):
+        raise ValueError("Can not write {} {} as png".format(array.shape, array.dtype))
+    if array.dtype.kind == 'f' and (low is None or high is None):
+        low, high = float(array.min()), float(array.max())
+    height, width = array.shape[:2]
+    big_endian = dtype.newbyteorder('>')
+    compressor = zlib.compressobj(compression)
+    rows = _chunk_rows(array)
+    with open(filename, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        _png_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, dtype.itemsize * 8,
+                                           PNG_MODES[channels], 0, 0, 0))
+        for y in range(0, height, rows):
+            block = np.ascontiguousarray(_to_dtype(np.asarray(array[y:y + rows]), dtype, low, high), big_endian)
+            block = block.reshape(block.shape[0], -1).view(np.uint8)
+            # Every row starts with filter type 0, no filtering
+            data = compressor.compress(np.hstack([np.zeros((block.shape[0], 1), np.uint8), block]).tobytes())
+            if data:
+                _png_chunk(f, b"IDAT", data)
+        _png_chunk(f, b"IDAT", compressor.flush())
+        _png_chunk(f, b"IEND", b"")
+
+
+def save_image(array: np.ndarray, filename: str, **kwargs):
+    """Saves by extension: .raw/.r32 float32, .r16 uint16, .npy, .png, anything else through PIL."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in RAW_DTYPES:
+        save_raw(array, filename, RAW_DTYPES[extension], **kwargs)
+    elif extension == ".npy":
+        save_npy(array, filename, **kwargs)
+    elif extension == ".png" and (array.dtype in (np.uint8, np.uint16) or array.dtype.kind == 'f'):
+        save_png(array, filename, **kwargs)
+    else:
+        Image.fromarray(np.asarray(array)).save(filename, **kwargs)
+
+
+def load_image(filename: str, width: int = None, height: int = None) -> np.ndarray:
+    """Maps .npy and raw files into memory instead of reading them. Raw files need their size unless square,
+    one side is enough to find the other. Images with several bands are read as their grey levels."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".npy":
+        return np.load(filename, mmap_mode='r')
+    if extension in RAW_DTYPES:
+        dtype = np.dtype(RAW_DTYPES[extension]).newbyteorder('<')
+        size = os.path.getsize(filename)
+        if size % dtype.itemsize:
+            raise ValueError("{} is {} bytes, not a whole number of {} byte samples".format(
+                filename, size, dtype.itemsize))
+        samples = size // dtype.itemsize
+        if width is None and height is None:
+            width = height = int(round(samples ** 0.5))
+            if width * height != samples:
+                raise ValueError("{} has {} samples, which is not a square, raw height maps that are not square "
+                                 "need their width and height".format(filename, samples))
+        elif width is None:
+            width = samples // height
+        elif height is None:
+            height = samples // width
+        if width * height != samples:
+            raise ValueError("{} has {} samples, not {}x{}".format(filename, samples, width, height))
+        return np.memmap(filename, dtype, 'r', shape=(height, width))
+    image = Image.open(filename)
+    if image.mode == "P" or len(image.getbands()) > 1:
+        # Grey levels of palette and color images, alpha left out, single band images keep their values
+        image = image.convert("RGB").convert("F")
+    return np.asarray(image)
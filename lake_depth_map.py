@@ -0,0 +1,26 @@
+import numpy as np
+from PIL import Image
+
+from base_maps import Map
+from lake_map import LakeMap
+from observables import Observable
+
+
+class LakeDepthMap(Map):
+    def __init__(self, controller: Observable, width, height, lake_map: LakeMap):
+        super().__init__(controller, width, height)
+        self.lake_map = lake_map
+        self.depends_on(lake_map)
+
+    def generate(self):
+        if self.valid:
+            return
+        filled_height_map = self.lake_map.filled_height_map
+        depth = filled_height_map.get_map() - filled_height_map.mean_height_map.get_map()
+        self._map = np.where(self.lake_map.get_map() > 0, depth, np.float32(0))
+        self.image = None
+        self.valid = True
+
+    @staticmethod
+    def to_image(array):
+        return Image.fromarray(array, "F")
@@ -0,0 +1,31 @@
+import numpy as np
+from PIL import Image
+
+from base_maps import Map
+from continent_map import LAND_DTYPE, ContinentMap
+from filled_height_map import FilledHeightMap
+from observables import Observable
+
+
+class LakeMap(Map):
+    """Land cells below the filled surface."""
+
+    def __init__(self, controller: Observable, width, height, filled_height_map: FilledHeightMap,
+                 continent_map: ContinentMap):
+        super().__init__(controller, width, height)
+        self.filled_height_map = filled_height_map
+        self.continent_map = continent_map
+        self.depends_on(filled_height_map, continent_map)
+
+    def generate(self):
+        if self.valid:
+            return
+        surface = self.filled_height_map.mean_height_map.get_map()
+        lakes = (self.filled_height_map.get_map() > surface) & (self.continent_map.get_map() > 0)
+        self._map = lakes.view(LAND_DTYPE)
+        self.image = None
+        self.valid = True
+
+    @staticmethod
+    def to_image(array):
+        return Image.fromarray(array.astype(np.int32), "I")
@@ -0,0 +1,69 @@
+import os
+import threading
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "map-generator", "layers")
+# Bump when a layer's algorithm or stored format changes, old entries are then never read again
+CACHE_VERSION = 1
+
+
+class LayerCache:
+    """Generated layers on disk as .npy files named by the layer key, oldest read entries are evicted first.
+
+    Entries are written to a temporary file and renamed into place, so several processes can share a cache
+    directory without ever reading a partial file.
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = 1 << 30):
+        cache_dir = cache_dir or os.environ.get("MAP_GENERATOR_LAYER_CACHE", DEFAULT_CACHE_DIR)
+        self.cache_dir = os.path.join(cache_dir, "v{}".format(CACHE_VERSION))
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            array = np.load(path, allow_pickle=False)
+            # Reads count as use for the eviction order
+            os.utime(path)
+            return array
+        except (OSError, ValueError):
+            # Missing, evicted by another process in the meantime or unreadable
+            return None
+
+    def put(self, key: str, array: np.ndarray) -> None:
+        path = self._path(key)
+        temporary = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(temporary, "wb") as f:
+                np.save(f, array, allow_pickle=False)
+            os.replace(temporary, path)
+        except OSError:
+            return
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(".npy"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
@@ -1,9 +1,16 @@
+import argparse
 import random
 import re
 
+from typing import Optional
+
 import configargparse
 
-from ui import Gui
+from backend import BACKENDS
+from erosion import Erosion
+from height_map import HEIGHT_DTYPES
+from imageutils import load_image
+from layer_cache import LayerCache
 
 
 def check_positive_integer(value):
@@ -42,17 +49,78 @@ class _ScaleEffectPair:
         return "{} / {}".format(self.scale, self.effect)
 
 
-def main():
-    p = configargparse.ArgParser(default_config_files=['map.conf'])
+def map_arguments(description=None) -> configargparse.ArgParser:
+    p = configargparse.ArgParser(default_config_files=['map.conf'], description=description)
     p.add('-c', '--config', required=False, is_config_file=True, help='Custom config file')
     p.add('-x', '--xSize', type=check_positive_integer)
     p.add('-y', '--ySize', type=check_positive_integer)
     p.add('--sea_level', type=int, default=75, help="Percentage of max height below which area is covered in water")
     p.add('--seed', default=random.randint(0, 10000))
     p.add('-f', '--filters', type=scale_pair)
-
+    p.add('--river_threshold', type=check_positive_integer, default=500,
+          help="Number of upstream cells draining through a cell before it is drawn as a river")
+    p.add('--mean_radius', type=check_positive_integer, default=30, help="Radius of the mean height window")
+    p.add('--backend', choices=BACKENDS, default='auto',
+          help="Kernel backend, auto falls back to numpy without OpenCL, multi splits maps between all OpenCL devices")
+    p.add('--workers', type=check_positive_integer, help="Worker threads for the numpy backend")
+    p.add('--cache_dir', help="Directory of the generated layer cache, defaults to ~/.cache/map-generator/layers")
+    p.add('--cache_size', type=check_positive_integer, default=1024,
+          help="Size limit of the layer cache in MiB, 0 disables the cache")
+    p.add('--heightmap', help="Height map file (.npy, .raw/.r32 float32, .r16 uint16 or an image) used instead of "
+                               "generated heights, the map takes its size, raw files that are not square need -x and "
+                               "-y on the command line")
+    p.add('--height_dtype', choices=HEIGHT_DTYPES, default='float32',
+          help="Type of the height maps kept in memory and in the layer cache, float16 halves their size")
+    p.add('--fill_depressions', action='store_true',
+          help="Route rivers across filled depressions instead of letting them end in pits, slower")
+    p.add('--erosion_iterations', type=check_positive_integer, default=0,
+          help="Time steps of hydraulic and thermal erosion run on the heights, 0 leaves them as generated")
+    p.add('--rain', type=float, default=0.01, help="Rain per cell and time unit of the erosion, 0 disables "
+                                                   "hydraulic erosion")
+    p.add('--talus', type=float, default=1.0, help="Height difference to a neighbour above which thermal erosion "
+                                                   "moves material down")
+    p.add('--thermal_rate', type=float, default=0.5, help="Share of the material above the talus moved per step, "
+                                                          "0 disables thermal erosion")
+    p.add('--profile', help="Write per stage timings, transfers and memory peaks as JSON to this file")
+    return p
+
+
+def parse_map_arguments(p: configargparse.ArgParser):
+    """Parses the arguments of map_arguments, sizing the map after --heightmap when there is one.
+
+    -x and -y from config files describe generated maps, raw height maps only use the ones given on the command
+    line and are taken to be square otherwise.
+    """
     args = p.parse_args()
+    if args.heightmap is not None:
+        command_line = p.get_source_to_settings_dict().get('command_line', {}).get('', (None, []))[1]
+        size = argparse.ArgumentParser(add_help=False)
+        size.add_argument('-x', '--xSize', type=int)
+        size.add_argument('-y', '--ySize', type=int)
+        given, _ = size.parse_known_args(command_line)
+        try:
+            heights = load_image(args.heightmap, given.xSize, given.ySize)
+        except (OSError, ValueError) as e:
+            p.error("Can not load --heightmap: {}".format(e))
+        args.ySize, args.xSize = heights.shape[:2]
+    return args
+
+
+def layer_cache(args) -> Optional[LayerCache]:
+    return LayerCache(args.cache_dir, args.cache_size << 20) if args.cache_size else None
+
+
+def erosion_settings(args) -> Optional[Erosion]:
+    erosion = Erosion(args.erosion_iterations, args.rain, args.talus, args.thermal_rate)
+    return erosion if erosion.enabled else None
+
+
+def main():
+    p = map_arguments()
+    p.add('--profile_overlay', action='store_true', help="Show stage timings next to the map")
+    args = parse_map_arguments(p)
 
+    from ui import Gui
     ui = Gui(args)
     ui.start()
 
@@ -8,157 +8,224 @@
 #define SOUTH_WEST 5
 #define NORTH_WEST 7
 
-uchar 	calculate_gradient_value(int4 start_rgb, int4 end_rgb, float value, uint channel, float min_value, float max_value) {
-	float percentage = (float)(value - min_value) / (float)(max_value - min_value);
-	if (channel == 0) {
-		return (uchar) start_rgb.s0 * (1 - percentage) + end_rgb.s0 * percentage;
-	}
-	if (channel == 1) {
-		return (uchar) start_rgb.s1 * (1 - percentage) + end_rgb.s1 * percentage;
-	}
-	if (channel == 2) {
-		return (uchar) start_rgb.s2 * (1 - percentage) + end_rgb.s2 * percentage;
-	}
-}
-
-
-kernel void ColoredMap(
+// Color of every height from a lookup table covering heights low...low + (lut_size - 1) / scale,
+// written as interleaved RGBA. Land cells with at least river_threshold upstream cells are drawn blue.
+__kernel void lut_colors(
 	__global	float*	heightMap,
-	__global	uchar* 	red,
-	__global	uchar* 	green,
-	__global	uchar* 	blue,
-				float	start,
-				float	end,
-				int4	start_rgb,
-				int4	end_rgb,
-				int		width,
-				int		height) {
+	__global	uchar4*	lut,
+	__global	uint*	rivers,
+	__global	uchar4*	colors,
+				float	low,
+				float	scale,
+				int		lut_size,
+				uint	river_threshold,
+				float	sea_height,
+				int		width) {
 	int x = get_global_id(1);
 	int y = get_global_id(0);
 	uint coord = x + y * width;
 
-	float value = heightMap[x + width * y];
-	uchar color;
-	if(value > start && value <= end){
-		uchar r, g, b;
-		red[coord] = calculate_gradient_value(start_rgb, end_rgb, value, 0, start, end);
-		green[coord] = calculate_gradient_value(start_rgb, end_rgb, value, 1, start, end);
-		blue[coord] = calculate_gradient_value(start_rgb, end_rgb, value, 2, start, end);
+	float height = heightMap[coord];
+	uchar4 color = lut[clamp((int)((height - low) * scale + 0.5f), 0, lut_size - 1)];
+	if (rivers && height > sea_height && rivers[coord] >= river_threshold) {
+		color.s2 = 255;
 	}
+	colors[coord] = color;
 }
 
 
-__kernel void calculate_mean (
+// 1 for cells above the sea, 0 for the others
+__kernel void land_mask(
+	__global	float*	heightMap,
+	__global	uchar*	mask,
+				float	sea_height) {
+	int i = get_global_id(0);
+	mask[i] = heightMap[i] > sea_height;
+}
+
+
+// Box mean in two separable running sum passes, cost per pixel does not depend on the radius.
+// Every work item slides the window over one segment of a row or column, edges are clamped.
+__kernel void box_sum_rows (
     __global float* input,
     __global float* output,
-    int window_size,
+    int radius,
     int width,
-    int height
+    int segment
     ) {
-    int x = get_global_id(1);
     int y = get_global_id(0);
+    int start = get_global_id(1) * segment;
+    int end = min(start + segment, width);
+    __global float* row = input + y * width;
 
-    float mean = 0;
-    int y_final;
-    int x_final;
-    for (int y1 = - window_size; y1 <= window_size ; y1++) {
-        for (int x1 = -window_size ; x1 <= window_size ; x1++) {
-        	y_final = min(max(0, y + y1), height);
-        	x_final = min(max(0, x + x1), width);
-            mean += input[y_final * width + x_final];
-        }
+    float sum = 0;
+    for (int x1 = start - radius; x1 <= start + radius; x1++) {
+        sum += row[clamp(x1, 0, width - 1)];
+    }
+    for (int x = start; x < end; x++) {
+        output[y * width + x] = sum;
+        sum += row[min(x + radius + 1, width - 1)] - row[max(x - radius, 0)];
     }
+}
+
 
-    float val = (mean / ((2*window_size+1)*(2*window_size+1)));
-    output[y * width + x] = val;
+__kernel void box_mean_columns (
+    __global float* input,
+    __global float* output,
+    int radius,
+    int width,
+    int height,
+    int segment
+    ) {
+    int x = get_global_id(1);
+    int start = get_global_id(0) * segment;
+    int end = min(start + segment, height);
+    float scale = 1.0f / ((2 * radius + 1) * (2 * radius + 1));
+
+    float sum = 0;
+    for (int y1 = start - radius; y1 <= start + radius; y1++) {
+        sum += input[clamp(y1, 0, height - 1) * width + x];
+    }
+    for (int y = start; y < end; y++) {
+        output[y * width + x] = sum * scale;
+        sum += input[min(y + radius + 1, height - 1) * width + x] - input[max(y - radius, 0) * width + x];
+    }
 }
 
 
-__kernel void gradient_direction (
-	__global float* x_value,
-	__global float* y_value,
-	__global uchar* output,
-			 int	width
+// Minimum and maximum of every row, the host reduces the per row results
+__kernel void row_min_max (
+	__global float*  input,
+	__global float2* output,
+			 int	 width
 			 ) {
-	int x = get_global_id(1);
 	int y = get_global_id(0);
 
-	int coord = x + y * width;
-
-	float x_val = x_value[coord];
-	float y_val = y_value[coord];
-
-	double angle = atan2(x_val, y_val);
-	char direction;
-
-	if (angle < (-M_PI * 7 / 8) || angle >= (M_PI * 7 / 8)) {
-		direction = NORTH;
-	} else if (angle >= (-M_PI * 7 / 8) && angle < (-M_PI * 5 / 8)) {
-		direction = NORTH_EAST;
-	} else if (angle >= (-M_PI * 5 / 8) && angle < (-M_PI * 3 / 8)) {
-		direction = EAST;
-	} else if (angle >= (-M_PI * 3 / 8) && angle < (-M_PI * 1 / 8)) {
-		direction = SOUTH_EAST;
-	} else if (angle >= (-M_PI * 1 / 8) && angle < (M_PI * 1 / 8)) {
-		direction = SOUTH;
-	} else if (angle >= (M_PI * 1 / 8) && angle < (M_PI * 3 / 8)) {
-		direction = SOUTH_WEST;
-	} else if (angle >= (M_PI * 3 / 8) && angle < (M_PI * 5 / 8)) {
-		direction = WEST;
-	} else if (angle >= (M_PI * 5 / 8) && angle < (M_PI * 7 / 8)) {
-		direction = NORTH_WEST;
+	float2 value = (float2)(input[y * width], input[y * width]);
+	for (int x = 1; x < width; x++) {
+		value.x = fmin(value.x, input[y * width + x]);
+		value.y = fmax(value.y, input[y * width + x]);
+	}
+	output[y] = value;
+}
+
+
+// tan(pi / 8), the directions split the circle at its odd multiples
+#define TAN_PI_8 0.414213562f
+
+// Direction of the angle atan2(x, y) rounded to the nearest eighth of a circle, using comparisons instead of
+// trigonometry. Cells without a gradient point south.
+uchar quantize_direction(float x, float y) {
+	float ax = fabs(x);
+	float ay = fabs(y);
+	if (ax < TAN_PI_8 * ay) {
+		return y < 0 ? NORTH : SOUTH;
+	}
+	if (ay < TAN_PI_8 * ax) {
+		return x < 0 ? EAST : WEST;
 	}
-	output[coord] = direction;
+	if (x == 0 && y == 0) {
+		return SOUTH;
+	}
+	if (x > 0) {
+		return y > 0 ? SOUTH_WEST : NORTH_WEST;
+	}
+	return y > 0 ? SOUTH_EAST : NORTH_EAST;
 }
 
 
-__kernel void generate_rivers(
-	__global uchar* gradient_direction,
-	__global int* 	output,
+// Central differences like numpy.gradient, one sided on the edges, quantized to a direction.
+// The slope magnitude is written too unless slope is NULL.
+__kernel void gradient_directions (
+	__global float* input,
+	__global uchar* directions,
+	__global float* slope,
 			 int	width,
 			 int	height
 			 ) {
 	int x = get_global_id(1);
 	int y = get_global_id(0);
 
-	int coord_index = x + y * width;
-
-  	uchar direction = gradient_direction[coord_index];
-  	int prev_val = 0;
-
-  	while (1) {
-		if (direction == NORTH) {
-			y++;
-		} else if (direction == NORTH_EAST) {
-			x++;
-			y++;
-		} else if (direction == EAST) {
-			x++;
-		} else if (direction == SOUTH_EAST) {
-			x++;
-			y--;
-		} else if (direction == SOUTH) {
-			y--;
-		} else if (direction == SOUTH_WEST) {
-			x--;
-			y--;
-		} else if (direction == WEST) {
-			x--;
-		} else if (direction == NORTH_WEST) {
-			x--;
-			y++;
-		}
-		if (x < 0 || x >= width || y < 0 || y >= height) {
-			return;
-		}
-		coord_index = x + y * width;
-		if(coord_index >= width * height) {
-			return;
-		}
-
-		if (atomic_inc(&output[coord_index]) > 10) {
-			return;
-		}
-		direction = gradient_direction[coord_index];
-  	}
+	int left = max(x - 1, 0);
+	int right = min(x + 1, width - 1);
+	int up = max(y - 1, 0);
+	int down = min(y + 1, height - 1);
+
+	float x_value = (input[right + y * width] - input[left + y * width]) / max(right - left, 1);
+	float y_value = (input[x + down * width] - input[x + up * width]) / max(down - up, 1);
+	directions[x + y * width] = quantize_direction(x_value, y_value);
+	if (slope) {
+		slope[x + y * width] = sqrt(x_value * x_value + y_value * y_value);
+	}
+}
+
+
+constant int direction_dx[8] = {0, 1, 1, 1, 0, -1, -1, -1};
+constant int direction_dy[8] = {1, 1, 0, -1, -1, -1, 0, 1};
+
+// Index of the cell the direction points to, -1 when it leaves the map
+int downstream(uchar direction, int index, int width, int height) {
+	int x = index % width + direction_dx[direction & 7];
+	int y = index / width + direction_dy[direction & 7];
+	if (x < 0 || x >= width || y < 0 || y >= height) {
+		return -1;
+	}
+	return x + y * width;
+}
+
+
+// Flow accumulation over the direction graph in topological order. Every cell starts with a flow
+// of one, cells enter the frontier once all their upstream cells have pushed their flow to them.
+__kernel void flow_init(
+	__global uchar* directions,
+	__global uint*	flow,
+	__global uint*	indegree,
+			 int	width,
+			 int	height
+			 ) {
+	int index = get_global_id(0);
+	flow[index] = 1;
+	int target = downstream(directions[index], index, width, height);
+	if (target >= 0) {
+		atomic_inc(&indegree[target]);
+	}
+}
+
+
+__kernel void flow_sources(
+	__global uint*	indegree,
+	__global int*	frontier,
+	__global uint*	frontier_size
+	) {
+	int index = get_global_id(0);
+	if (indegree[index] == 0) {
+		frontier[atomic_inc(frontier_size)] = index;
+	}
+}
+
+
+__kernel void flow_push(
+	__global uchar* directions,
+	__global uint*	flow,
+	__global uint*	indegree,
+	__global int*	frontier,
+	__global int*	next_frontier,
+	__global uint*	frontier_size,
+	__global uint*	next_frontier_size,
+			 int	width,
+			 int	height
+			 ) {
+	// Launched for at least as many cells as the frontier holds, frontiers never grow
+	if (get_global_id(0) >= *frontier_size) {
+		return;
+	}
+	int index = frontier[get_global_id(0)];
+	int target = downstream(directions[index], index, width, height);
+	if (target < 0) {
+		return;
+	}
+	atomic_add(&flow[target], flow[index]);
+	if (atomic_dec(&indegree[target]) == 1) {
+		next_frontier[atomic_inc(next_frontier_size)] = target;
+	}
 }
@@ -16,3 +16,7 @@ class MapTypes(AutoNumber):
     CONTINENT_MAP = ()
     RIVER_MAP = ()
     MEAN_HEIGHT_MAP = ()
+    SLOPE_MAP = ()
+    FILLED_HEIGHT_MAP = ()
+    LAKE_MAP = ()
+    LAKE_DEPTH_MAP = ()
@@ -1,30 +1,28 @@
-import numpy as np
-import pyopencl as cl
+from PIL import Image
 
-from base_maps import CLMap
+from backend import Backend
+from base_maps import BackendMap
 from height_map import HeightMap
 from observables import Observable
 
 
-class MeanHeightMap(CLMap):
-    def __init__(self, controller: Observable, width, height, ctx, height_map: HeightMap):
-        super().__init__(controller, width, height, ctx)
+class MeanHeightMap(BackendMap):
+    def __init__(self, controller: Observable, width, height, backend: Backend, height_map: HeightMap,
+                 radius: int = 30):
+        super().__init__(controller, width, height, backend)
         self.height_map = height_map
-        self.map_tools = cl.Program(self.ctx, open("maptools.cl").read()).build()
-        self.generate()
+        self.depends_on(height_map)
+        self.radius = radius
 
     def generate(self):
-        if not self.height_map.valid:
-            self.height_map.generate()
-        queue = cl.CommandQueue(self.ctx)
-        self._map = np.zeros_like(self.height_map.get_map(), dtype=np.float32)
-        input_buf = cl.Buffer(self.ctx, cl.mem_flags.COPY_HOST_PTR, hostbuf=self.height_map.get_map())
-        output_buf = cl.Buffer(self.ctx, cl.mem_flags.WRITE_ONLY, size=self._map.nbytes)
+        if self.valid:
+            return
+        self.set_data(self.backend.mean(self.height_map.get_data(), self.radius))
+        self.valid = True
 
-        event = self.map_tools.calculate_mean(queue, (self.height, self.width), None,
-                                              input_buf,
-                                              output_buf,
-                                              np.int32(30),
-                                              np.int32(self.width),
-                                              np.int32(self.height))
-        cl.enqueue_copy(queue, self._map, output_buf, wait_for=[event])
+    def parameters(self):
+        return super().parameters() + (self.radius,)
+
+    @staticmethod
+    def to_image(array):
+        return Image.fromarray(array, "F")
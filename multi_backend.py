@@ -0,0 +1,133 @@
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Sequence
+
+import numpy as np
+
+from backend import Backend
+from tiles import Window
+
+
+class MultiBackend(Backend):
+    """Splits every stage into row bands run on several backends at once, one OpenCL device each for example.
+
+    Bands are sized in proportion to the rows per second each backend last reached in the same stage, stencil
+    stages get halo rows from their neighbours so the stitched result is the same as one band over the whole map.
+    Arrays stay on the host between stages, the bands are copied to and from the devices.
+    """
+    name = 'multi'
+
+    def __init__(self, backends: Sequence[Backend], profiler=None):
+        if not backends:
+            raise ValueError("No backends to split the work between")
+        self.backends = list(backends)
+        self.profiler = profiler
+        # One thread per backend, a device never runs two bands at once
+        self._pools = [ThreadPoolExecutor(1) for _ in self.backends]
+        # Rows per second of every backend in every stage, None until measured
+        self.throughput = defaultdict(lambda: [None] * len(self.backends))
+
+    def bands(self, stage: str, rows: int):
+        # (backend index, first row, end row) proportional to the measured throughput, unmeasured backends get
+        # the mean of the measured ones
+        rates = self.throughput[stage]
+        known = [rate for rate in rates if rate is not None]
+        default = sum(known) / len(known) if known else 1.0
+        weights = np.array([default if rate is None else rate for rate in rates], np.float64)
+        ends = np.rint(np.cumsum(weights) / weights.sum() * rows).astype(int)
+        starts = np.concatenate([[0], ends[:-1]])
+        return [(index, int(y0), int(y1)) for index, (y0, y1) in enumerate(zip(starts, ends)) if y1 > y0]
+
+    def _run(self, stage: str, rows: int, halo: int, function, axis: int = 0):
+        # function(backend, first padded row, end padded row) returns host arrays, or tuples of them, for the
+        # padded band, the halo rows are cut off again before stitching along axis
+        def run(index, y0, y1):
+            p0, p1 = max(0, y0 - halo), min(rows, y1 + halo)
+            start = time.perf_counter()
+            result = function(self.backends[index], p0, p1)
+            seconds = time.perf_counter() - start
+            rate = (y1 - y0) / max(seconds, 1e-9)
+            previous = self.throughput[stage][index]
+            self.throughput[stage][index] = rate if previous is None else (previous + rate) / 2
+            inner = (slice(None),) * axis + (slice(y0 - p0, y1 - p0),)
+            if isinstance(result, tuple):
+                return tuple(part[inner] for part in result)
+            return result[inner]
+
+        futures = [self._pools[index].submit(run, index, y0, y1) for index, y0, y1 in self.bands(stage, rows)]
+        parts = [future.result() for future in futures]
+        if isinstance(parts[0], tuple):
+            return tuple(np.concatenate(band, axis) for band in zip(*parts))
+        return np.concatenate(parts, axis)
+
+    @staticmethod
+    def _on(backend: Backend, operation, *arrays):
+        # operation on copies of host arrays on backend, results copied back to the host
+        device_arrays = [backend.to_device(array) if array is not None else None for array in arrays]
+        result = operation(*device_arrays)
+        results = result if isinstance(result, tuple) else (result,)
+        host = tuple(backend.to_host(part) for part in results)
+        for array in device_arrays + list(results):
+            if array is not None:
+                backend.release(array)
+        return host if isinstance(result, tuple) else host[0]
+
+    def to_device(self, array):
+        return np.ascontiguousarray(array)
+
+    def to_host(self, array):
+        return array
+
+    def min_max(self, array):
+        return float(array.min()), float(array.max())
+
+    def batch_item(self, array, index):
+        return array[index]
+
+    def _band_window(self, window: Window, p0: int, p1: int) -> Window:
+        return Window(window.x, window.y + p0 * window.step, window.width, p1 - p0, window.world_width,
+                      window.world_height, window.step)
+
+    def height_map(self, window, octaves):
+        return self._run("height_map", window.height, 0, lambda backend, p0, p1: self._on(
+            backend, lambda: backend.height_map(self._band_window(window, p0, p1), octaves)))
+
+    def height_maps(self, window, octave_sets):
+        return self._run("height_maps", window.height, 0, lambda backend, p0, p1: self._on(
+            backend, lambda: backend.height_maps(self._band_window(window, p0, p1), octave_sets)), axis=1)
+
+    def mean(self, height_map, radius):
+        return self._run("mean", height_map.shape[0], radius, lambda backend, p0, p1: self._on(
+            backend, lambda band: backend.mean(band, radius), height_map[p0:p1]))
+
+    def gradient_directions(self, height_map, slope=False):
+        result = self._run("gradient_directions", height_map.shape[0], 1, lambda backend, p0, p1: self._on(
+            backend, lambda band: backend.gradient_directions(band, slope)[:1 + slope], height_map[p0:p1]))
+        return result if slope else (result[0], None)
+
+    def _fastest(self) -> Backend:
+        # The backend fastest at the stages split so far, for stages that need the whole map
+        rates = [sum(stage_rates[index] or 0.0 for stage_rates in self.throughput.values())
+                 for index in range(len(self.backends))]
+        return self.backends[int(np.argmax(rates))]
+
+    def flow_accumulation(self, directions):
+        # Flow crosses every band boundary
+        backend = self._fastest()
+        return self._on(backend, backend.flow_accumulation, directions)
+
+    def land_mask(self, height_map, sea_height):
+        return self._run("land_mask", height_map.shape[0], 0, lambda backend, p0, p1: self._on(
+            backend, lambda band: backend.land_mask(band, sea_height), height_map[p0:p1]))
+
+    def lut_colors(self, height_map, lut, low, high, rivers=None, river_threshold=0, sea_height=0.0):
+        return self._run("lut_colors", height_map.shape[0], 0, lambda backend, p0, p1: self._on(
+            backend, lambda heights, band_rivers: backend.lut_colors(heights, lut, low, high, band_rivers,
+                                                                     river_threshold, sea_height),
+            height_map[p0:p1], rivers[p0:p1] if rivers is not None else None))
+
+    def erode(self, height_map, erosion, progress=None):
+        # Every iteration would need fresh halo rows from the other bands, one device runs all of them instead
+        backend = self._fastest()
+        return self._on(backend, lambda heights: backend.erode(heights, erosion, progress), height_map)
@@ -324,20 +324,49 @@ float  map256(float v)
 // End of Intel stuff
 
 
-// Create height map based on noise
-kernel void HeightMap(
+// Multiplier falling from 1 in the center of the world to 0.5 in its corners, turns the map into an island
+float island_multiplier(int x, int y, int world_width, int world_height)
+{
+	int center_x = (int)world_width / 2;
+	int center_y = (int)world_height / 2;
+
+	float distance = sqrt(pow(x - center_x, 2.0f) + pow(y - center_y, 2.0f));
+	float max_distance = sqrt(pow(center_x, 2.0f) + pow(center_y, 2.0f));
+	float multiplier = (max_distance - distance) / max_distance / 2 + 0.5;
+	return multiplier;
+}
+
+
+// Create height maps based on noise. Each output is a width x height window at (x_offset, y_offset)
+// of a world_width x world_height map sampling every step-th cell, so neighbouring windows line up seamlessly.
+// All octaves are summed in one pass and the island multiplier is applied before the only store.
+// The first dimension is the map of a batch, seeds holds octave_count seeds for every map.
+// Seeds are global, a large batch may hold more of them than constant memory.
+kernel void IslandHeightMap(
 	__global 	float* 	outputImage,
+	__global const	int*	seeds,
+	__constant	float2*	octaves,
+				int		octave_count,
 				int		width,
 				int		height,
-				int		seed,
-				float	scale,
-				float	magnitude
+				int		x_offset,
+				int		y_offset,
+				int		world_width,
+				int		world_height,
+				int		step
 	) {
-		int x = get_global_id(1);
-		int y = get_global_id(0);
-
-		float prev_value = outputImage[x + width * y];
-		float value = Noise_2d(128*(float)(x + seed) * 1/width * scale, 128 * (float)(y + seed) * 1/height * scale) * magnitude * 127.5;
-		outputImage[x + width * y] = prev_value + value;
+		int map = get_global_id(0);
+		int x = get_global_id(2) * step + x_offset;
+		int y = get_global_id(1) * step + y_offset;
+		__global const int* map_seeds = seeds + map * octave_count;
+
+		float height_value = 127.5f;
+		for (int i = 0; i < octave_count; i++) {
+			float scale = octaves[i].x;
+			float magnitude = octaves[i].y;
+			float value = Noise_2d(128*(float)(x + map_seeds[i]) * 1/world_width * scale, 128 * (float)(y + map_seeds[i]) * 1/world_height * scale) * magnitude * 127.5;
+			height_value = height_value + value;
+		}
+		float multiplier = island_multiplier(x, y, world_width, world_height);
+		outputImage[get_global_id(2) + width * (get_global_id(1) + height * map)] = multiplier * height_value;
 }
-
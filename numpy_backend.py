@@ -0,0 +1,369 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from backend import Backend, lut_scale
+from erosion import GRAVITY, MIN_DEPTH, PROGRESS_INTERVAL, proceed
+
+# Same permutation and gradient tables as noise/Noise.cl
+DEFAULT_PERM = np.array([
+    151, 91, 90, 15, 131, 13, 201, 95, 96, 53, 194, 233, 7, 225, 99, 37,
+    8, 240, 21, 10, 23, 190, 6, 148, 247, 120, 234, 75, 0, 26, 160, 137,
+    35, 11, 32, 57, 177, 33, 88, 237, 149, 56, 87, 174, 20, 125, 136, 171,
+    134, 139, 48, 27, 166, 77, 146, 158, 231, 83, 111, 229, 122, 60, 211, 133,
+    55, 46, 245, 40, 244, 102, 143, 54, 65, 25, 63, 161, 1, 216, 80, 73,
+    18, 169, 200, 196, 135, 130, 116, 188, 159, 86, 164, 100, 109, 198, 173, 186,
+    250, 124, 123, 5, 202, 38, 147, 118, 126, 255, 82, 85, 212, 207, 206, 59,
+    189, 28, 42, 223, 183, 170, 213, 119, 248, 152, 2, 44, 154, 163, 70, 221,
+    43, 172, 9, 129, 22, 39, 253, 19, 98, 108, 110, 79, 113, 224, 232, 178,
+    97, 228, 251, 34, 242, 193, 238, 210, 144, 12, 191, 179, 162, 241, 81, 51,
+    107, 49, 192, 214, 31, 181, 199, 106, 157, 184, 84, 204, 176, 115, 121, 50,
+    138, 236, 205, 93, 222, 114, 67, 29, 24, 72, 243, 141, 128, 195, 78, 66,
+    140, 36, 103, 30, 227, 47, 16, 58, 69, 17, 209, 76, 132, 187, 45, 127,
+    197, 62, 94, 252, 153, 101, 155, 167, 219, 182, 3, 64, 52, 217, 215, 61,
+    168, 68, 175, 74, 185, 112, 104, 218, 165, 246, 4, 150, 208, 254, 142, 71,
+    230, 220, 105, 92, 145, 235, 249, 14, 41, 239, 156, 180, 226, 89, 203, 117,
+], np.int32)
+
+GRADS2D = np.array([
+    [-0.195090322, -0.98078528],
+    [-0.555570233, -0.831469612],
+    [-0.831469612, -0.555570233],
+    [-0.98078528, -0.195090322],
+    [-0.98078528, 0.195090322],
+    [-0.831469612, 0.555570233],
+    [-0.555570233, 0.831469612],
+    [-0.195090322, 0.98078528],
+    [0.195090322, 0.98078528],
+    [0.555570233, 0.831469612],
+    [0.831469612, 0.555570233],
+    [0.98078528, 0.195090322],
+    [0.98078528, -0.195090322],
+    [0.831469612, -0.555570233],
+    [0.555570233, -0.831469612],
+    [0.195090322, -0.98078528],
+], np.float32)
+
+# Cells computed at once by the noise, small enough for the temporaries to stay in cache
+CHUNK_CELLS = 1 << 15
+
+TAN_PI_8 = np.float32(0.414213562)
+
+# Step taken for each Direction code, see downstream in maptools.cl
+DIRECTION_DX = np.array([0, 1, 1, 1, 0, -1, -1, -1], np.int64)
+DIRECTION_DY = np.array([1, 1, 0, -1, -1, -1, 0, 1], np.int64)
+
+# (dy, dx) of the left, right, upper and lower neighbour, the order of the erosion fluxes in erosion.cl
+PIPES = ((0, -1), (0, 1), (-1, 0), (1, 0))
+
+
+def _weight(w):
+    return w * w * w * (w * (w * np.float32(6) - np.float32(15)) + np.float32(10))
+
+
+def _grad_dot(hash_, x, y):
+    grad = GRADS2D[hash_ & 0x0f]
+    return x * grad[..., 0] + y * grad[..., 1]
+
+
+def noise_2d(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, np.float32)
+    y = np.asarray(y, np.float32)
+    lower_x = np.floor(x)
+    lower_y = np.floor(y)
+    vx = x - lower_x
+    vy = y - lower_y
+    ux = lower_x.astype(np.int32)
+    uy = lower_y.astype(np.int32)
+
+    px = DEFAULT_PERM[ux & 0xff]
+    p_x = DEFAULT_PERM[(ux + 1) & 0xff]
+
+    pxy = DEFAULT_PERM[(px + uy) & 0xff]
+    p_xy = DEFAULT_PERM[(p_x + uy) & 0xff]
+    px_y = DEFAULT_PERM[(px + uy + 1) & 0xff]
+    p_x_y = DEFAULT_PERM[(p_x + uy + 1) & 0xff]
+
+    one = np.float32(1)
+    gxy = _grad_dot(pxy, vx, vy)
+    g_xy = _grad_dot(p_xy, vx - one, vy)
+    gx_y = _grad_dot(px_y, vx, vy - one)
+    g_x_y = _grad_dot(p_x_y, vx - one, vy - one)
+
+    wx = _weight(vx)
+    wy = _weight(vy)
+    low = gxy + (g_xy - gxy) * wx
+    high = gx_y + (g_x_y - gx_y) * wx
+    return low + (high - low) * wy
+
+
+def quantize_directions(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    # quantize_direction of maptools.cl, atan2(x, y) rounded to eighths of a circle by comparisons
+    ax = np.abs(x)
+    ay = np.abs(y)
+    diagonal = np.where(x > 0, np.where(y > 0, 5, 7), np.where(y > 0, 3, 1))
+    diagonal[(x == 0) & (y == 0)] = 4
+    across = np.where(ay < TAN_PI_8 * ax, np.where(x < 0, 2, 6), diagonal)
+    return np.where(ax < TAN_PI_8 * ay, np.where(y < 0, 0, 4), across).astype(np.uint8)
+
+
+def _shifted(array: np.ndarray, y0: int, y1: int, dy: int, dx: int, fill=None) -> np.ndarray:
+    # Values at (y + dy, x + dx) for the rows y0...y1 and steps of one cell, outside the map the nearest edge value
+    # or fill. Read only, may be a view of array
+    height, width = array.shape
+    if 0 <= y0 + dy and y1 + dy <= height:
+        source = array[y0 + dy:y1 + dy]
+    else:
+        source = array[np.clip(np.arange(y0 + dy, y1 + dy), 0, height - 1)]
+    if dx == 0 and fill is None:
+        band = source
+    else:
+        band = np.empty_like(source)
+        if dx > 0:
+            band[:, :-1] = source[:, 1:]
+            band[:, -1] = source[:, -1]
+        elif dx < 0:
+            band[:, 1:] = source[:, :-1]
+            band[:, 0] = source[:, 0]
+        else:
+            band[:] = source
+    if fill is not None:
+        if y0 + dy < 0:
+            band[0] = fill
+        if y1 + dy > height:
+            band[-1] = fill
+        if dx:
+            band[:, -1 if dx > 0 else 0] = fill
+    return band
+
+
+class NumpyBackend(Backend):
+    name = 'numpy'
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(self.workers)
+
+    def _bands(self, rows: int):
+        band = max(1, -(-rows // self.workers))
+        return [(y0, min(rows, y0 + band)) for y0 in range(0, rows, band)]
+
+    def _run_bands(self, function, rows: int):
+        for future in [self.pool.submit(function, y0, y1) for y0, y1 in self._bands(rows)]:
+            future.result()
+
+    def to_device(self, array):
+        return np.ascontiguousarray(array)
+
+    def to_host(self, array):
+        return array
+
+    def min_max(self, array):
+        return float(array.min()), float(array.max())
+
+    def batch_item(self, array, index):
+        return array[index]
+
+    def height_map(self, window, octaves):
+        return self.height_maps(window, [octaves])[0]
+
+    def height_maps(self, window, octave_sets):
+        maps = len(octave_sets)
+        result = np.empty((maps * window.height, window.width), np.float32)
+        # Rows of all maps one after another, with the octave seeds of the map each row belongs to
+        seeds = np.array([[seed for seed, _, _ in octaves] for octaves in octave_sets], np.int64).reshape(maps, -1)
+        row_seeds = np.repeat(seeds, window.height, axis=0)
+        row_ys = np.tile(window.y + np.arange(window.height) * window.step, maps)
+        xs = window.x + np.arange(window.width) * window.step
+        center_x = window.world_width // 2
+        center_y = window.world_height // 2
+        max_distance = np.float32(np.sqrt(np.float32(center_x ** 2 + center_y ** 2)))
+        dx = (xs - center_x).astype(np.float32) ** 2
+        # Rows per chunk, the temporaries of a chunk stay in cache between the octaves
+        chunk = max(1, CHUNK_CELLS // window.width)
+
+        def band(r0, r1):
+            for c0 in range(r0, r1, chunk):
+                c1 = min(r1, c0 + chunk)
+                ys = row_ys[c0:c1, np.newaxis]
+                heights = np.full((c1 - c0, window.width), 127.5, np.float32)
+                for octave, (_, scale, effect) in enumerate(octave_sets[0]):
+                    scale = np.float32(scale)
+                    seed = row_seeds[c0:c1, octave, np.newaxis]
+                    x = np.float32(128) * (xs + seed).astype(np.float32) / np.float32(window.world_width) * scale
+                    y = np.float32(128) * (ys + seed).astype(np.float32) / np.float32(window.world_height) * scale
+                    heights += noise_2d(x, y) * np.float32(effect) * np.float32(127.5)
+                distance = np.sqrt(dx + (ys - center_y).astype(np.float32) ** 2)
+                multiplier = (max_distance - distance) / max_distance / np.float32(2) + np.float32(0.5)
+                np.multiply(heights, multiplier, out=result[c0:c1])
+
+        self._run_bands(band, maps * window.height)
+        return result.reshape((maps,) + window.shape)
+
+    def mean(self, height_map, radius):
+        height, width = height_map.shape
+        result = np.empty((height, width), np.float32)
+        window = 2 * radius + 1
+        columns = np.clip(np.arange(-radius, width + radius), 0, width - 1)
+
+        def band(y0, y1):
+            # Edge-clamped window summed separably with prefix sums, independent of the radius
+            rows = np.clip(np.arange(y0 - radius, y1 + radius), 0, height - 1)
+            padded = height_map[rows][:, columns].astype(np.float64)
+            sums = np.zeros((padded.shape[0] + 1, padded.shape[1]), np.float64)
+            np.cumsum(padded, axis=0, out=sums[1:])
+            vertical = sums[window:] - sums[:-window]
+            sums = np.zeros((vertical.shape[0], vertical.shape[1] + 1), np.float64)
+            np.cumsum(vertical, axis=1, out=sums[:, 1:])
+            result[y0:y1] = (sums[:, window:] - sums[:, :-window]) / (window * window)
+
+        self._run_bands(band, height)
+        return result
+
+    def gradient_directions(self, height_map, slope=False):
+        height, width = height_map.shape
+        directions = np.empty((height, width), np.uint8)
+        slopes = np.empty((height, width), np.float32) if slope else None
+
+        def band(y0, y1):
+            # Rows around the band for the central differences, the same arithmetic as the OpenCL kernel
+            r0, r1 = max(0, y0 - 1), min(height, y1 + 1)
+            x_value = np.gradient(height_map[y0:y1], axis=1) if width > 1 else np.zeros((y1 - y0, 1), np.float32)
+            y_value = np.gradient(height_map[r0:r1], axis=0)[y0 - r0:y1 - r0] if height > 1 else \
+                np.zeros((1, width), np.float32)
+            directions[y0:y1] = quantize_directions(x_value, y_value)
+            if slopes is not None:
+                slopes[y0:y1] = np.sqrt(x_value * x_value + y_value * y_value)
+
+        self._run_bands(band, height)
+        return directions, slopes
+
+    def flow_accumulation(self, directions):
+        height, width = directions.shape
+        cells = np.arange(directions.size, dtype=np.int64)
+        flat_directions = directions.ravel()
+        x = cells % width + DIRECTION_DX[flat_directions]
+        y = cells // width + DIRECTION_DY[flat_directions]
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        downstream = np.where(inside, y * width + x, -1)
+
+        flow = np.ones(directions.size, np.uint32)
+        indegree = np.bincount(downstream[inside], minlength=directions.size)
+        frontier = np.flatnonzero(indegree == 0)
+        # Kahn's algorithm one topological level at a time, each cell is pushed exactly once
+        while frontier.size:
+            targets = downstream[frontier]
+            frontier = frontier[targets >= 0]
+            targets = targets[targets >= 0]
+            np.add.at(flow, targets, flow[frontier])
+            np.subtract.at(indegree, targets, 1)
+            frontier = np.unique(targets[indegree[targets] == 0])
+        return flow.reshape(height, width)
+
+    def land_mask(self, height_map, sea_height):
+        mask = np.empty(height_map.shape, np.uint8)
+
+        def band(y0, y1):
+            np.greater(height_map[y0:y1], np.float32(sea_height), out=mask[y0:y1])
+
+        self._run_bands(band, height_map.shape[0])
+        return mask
+
+    def lut_colors(self, height_map, lut, low, high, rivers=None, river_threshold=0, sea_height=0.0):
+        colors = np.empty(height_map.shape + (4,), np.uint8)
+        scale = np.float32(lut_scale(lut, low, high))
+
+        def band(y0, y1):
+            heights = height_map[y0:y1]
+            index = ((heights - np.float32(low)) * scale + np.float32(0.5)).astype(np.int32)
+            np.take(lut, np.clip(index, 0, len(lut) - 1), axis=0, out=colors[y0:y1])
+            if rivers is not None:
+                river = (heights > np.float32(sea_height)) & (rivers[y0:y1] >= river_threshold)
+                colors[y0:y1, :, 2][river] = 255
+
+        self._run_bands(band, height_map.shape[0])
+        return colors
+
+    def erode(self, height_map, erosion, progress=None):
+        # The steps of erosion.cl, every step reads the first array of each pair and writes the second
+        height, width = height_map.shape
+        dt = np.float32(erosion.time_step)
+        rain = np.float32(erosion.rain * erosion.time_step)
+        acceleration = np.float32(GRAVITY * erosion.time_step)
+        terrain = [np.array(height_map, np.float32), np.empty((height, width), np.float32)]
+        water = [np.zeros((height, width), np.float32), np.empty((height, width), np.float32)]
+        sediment = [np.zeros((height, width), np.float32), np.empty((height, width), np.float32)]
+        flux = [np.zeros((4, height, width), np.float32), np.empty((4, height, width), np.float32)]
+        share = np.empty((height, width), np.float32)
+
+        def flux_band(y0, y1):
+            depth = water[0][y0:y1] + rain
+            surface = terrain[0][y0:y1] + water[0][y0:y1]
+            result = flux[1][:, y0:y1]
+            for pipe, (dy, dx) in enumerate(PIPES):
+                neighbour = _shifted(terrain[0], y0, y1, dy, dx, np.inf) + _shifted(water[0], y0, y1, dy, dx, 0)
+                np.maximum(flux[0][pipe, y0:y1] + acceleration * (surface - neighbour), 0, out=result[pipe])
+            total = result.sum(0) * dt
+            result *= np.where(total > depth, depth / np.maximum(total, np.float32(MIN_DEPTH)), np.float32(1))
+            # Sediment per unit of water, for its transport in water_band
+            np.divide(sediment[0][y0:y1], np.maximum(depth, np.float32(MIN_DEPTH)), out=share[y0:y1])
+
+        def water_band(y0, y1):
+            outflow = flux[0][:, y0:y1]
+            inflows = [_shifted(flux[0][1], y0, y1, 0, -1, 0), _shifted(flux[0][0], y0, y1, 0, 1, 0),
+                       _shifted(flux[0][3], y0, y1, -1, 0, 0), _shifted(flux[0][2], y0, y1, 1, 0, 0)]
+            from_left, from_right, from_up, from_down = inflows
+            total_outflow = outflow.sum(0)
+            depth = water[0][y0:y1] + rain
+            new_depth = np.maximum(depth + dt * (sum(inflows) - total_outflow), 0)
+            mean_depth = (depth + new_depth) * np.float32(0.5)
+            scale = np.where(mean_depth > MIN_DEPTH, np.float32(0.5) / np.maximum(mean_depth, np.float32(MIN_DEPTH)),
+                             np.float32(0))
+            u = (from_left - outflow[0] + outflow[1] - from_right) * scale
+            v = (from_up - outflow[2] + outflow[3] - from_down) * scale
+
+            # Sediment leaves with the same share of the water as the water, see flux_band
+            suspended = sediment[0][y0:y1] - share[y0:y1] * total_outflow * dt
+            for inflow, (dy, dx) in zip(inflows, PIPES):
+                suspended += _shifted(share, y0, y1, dy, dx, 0) * inflow * dt
+
+            gx = (_shifted(terrain[0], y0, y1, 0, 1) - _shifted(terrain[0], y0, y1, 0, -1)) * np.float32(0.5)
+            gy = (_shifted(terrain[0], y0, y1, 1, 0) - _shifted(terrain[0], y0, y1, -1, 0)) * np.float32(0.5)
+            tilt = np.sqrt(gx * gx + gy * gy)
+            tilt /= np.sqrt(1 + tilt * tilt)
+            carried = np.float32(erosion.capacity) * np.maximum(tilt, np.float32(erosion.min_tilt)) * \
+                np.sqrt(u * u + v * v) * new_depth
+            amount = np.where(carried > suspended, np.float32(erosion.dissolving) * (carried - suspended),
+                              np.float32(-erosion.deposition) * (suspended - carried))
+            np.subtract(terrain[0][y0:y1], amount, out=terrain[1][y0:y1])
+            np.add(suspended, amount, out=sediment[1][y0:y1])
+            np.multiply(new_depth, np.float32(1 - erosion.evaporation * erosion.time_step), out=water[1][y0:y1])
+
+        def thermal_band(y0, y1):
+            heights = terrain[0][y0:y1]
+            change = np.zeros(heights.shape, np.float32)
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    if dx == 0 and dy == 0:
+                        continue
+                    limit = np.float32(erosion.talus * (np.sqrt(2) if dx and dy else 1))
+                    # NaN outside the map, fmax leaves those neighbours out
+                    difference = _shifted(terrain[0], y0, y1, dy, dx, np.nan) - heights
+                    change += np.fmax(difference - limit, 0) - np.fmax(-difference - limit, 0)
+            np.add(heights, change * np.float32(erosion.thermal_rate * 0.0625), out=terrain[1][y0:y1])
+
+        for done in range(1, erosion.iterations + 1):
+            if erosion.hydraulic:
+                self._run_bands(flux_band, height)
+                flux.reverse()
+                self._run_bands(water_band, height)
+                for pair in (terrain, water, sediment):
+                    pair.reverse()
+            if erosion.thermal:
+                self._run_bands(thermal_band, height)
+                terrain.reverse()
+            if (done % PROGRESS_INTERVAL == 0 or done == erosion.iterations) and \
+                    not proceed(progress, done, erosion.iterations):
+                break
+        return terrain[0] + sediment[0]
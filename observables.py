@@ -19,7 +19,6 @@ class Observable:
         self.observers.remove(observer)
 
     def notify(self, event):
-        self.valid = False
         for observer in self.observers:
             observer.handle(self, event)
 
@@ -0,0 +1,169 @@
+import json
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+# Stage of work done outside Profiler.stage, host copies made for images for example
+OTHER_STAGE = "other"
+# Events of work outside any stage kept before they are read, reports and resets read them too
+MAX_PENDING = 1024
+
+
+class StageProfile:
+    def __init__(self):
+        self.calls = 0
+        self.cache_hits = 0
+        self.wall_time = 0.0
+        self.kernel_time = 0.0
+        self.kernels = defaultdict(lambda: [0, 0.0])
+        self.to_device_bytes = 0
+        self.to_host_bytes = 0
+        self.transfer_time = 0.0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "wall_time": self.wall_time,
+            "kernel_time": self.kernel_time,
+            "kernels": {name: {"calls": calls, "time": seconds} for name, (calls, seconds) in self.kernels.items()},
+            "to_device_bytes": self.to_device_bytes,
+            "to_host_bytes": self.to_host_bytes,
+            "transfer_time": self.transfer_time,
+        }
+
+
+class Profiler:
+    """Collects wall time, OpenCL kernel and transfer time, transferred bytes, build times and memory peaks.
+
+    OpenCL events are only read when their stage ends, so profiling waits for each stage to finish on the device.
+    trace_host_memory starts tracemalloc until close, which makes Python code several times slower.
+    """
+
+    def __init__(self, trace_host_memory: bool = False):
+        self.stages = defaultdict(StageProfile)
+        self.builds = {}
+        self.peak_bytes = defaultdict(int)
+        self._current = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pending = []
+        self._tracing = trace_host_memory and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+
+    def close(self) -> None:
+        # Stops the memory tracing started by this profiler
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def stage(self, name: str):
+        # Set cache_hit on the yielded object when the stage only read its result from the cache
+        self._local.stage = name
+        self._local.events = []
+        run = SimpleNamespace(cache_hit=False)
+        start = time.perf_counter()
+        try:
+            yield run
+        finally:
+            events = self._local.events
+            del self._local.stage, self._local.events
+            for event in events:
+                self._resolve(name, event)
+            with self._lock:
+                profile = self.stages[name]
+                profile.calls += 1
+                profile.cache_hits += run.cache_hit
+                profile.wall_time += time.perf_counter() - start
+
+    def _record(self, kind, name, nbytes, event):
+        stage = getattr(self._local, 'stage', None)
+        if stage is None:
+            with self._lock:
+                self._pending.append((OTHER_STAGE, (kind, name, nbytes, event)))
+                pending = []
+                if len(self._pending) > MAX_PENDING:
+                    pending, self._pending = self._pending, []
+            for stage, record in pending:
+                self._resolve(stage, record)
+        else:
+            self._local.events.append((kind, name, nbytes, event))
+        return event
+
+    def kernel(self, name: str, event):
+        return self._record("kernel", name, 0, event)
+
+    def transfer(self, direction: str, nbytes: int, event):
+        return self._record(direction, None, nbytes, event)
+
+    def _resolve(self, stage, record):
+        kind, name, nbytes, event = record
+        event.wait()
+        seconds = (event.profile.end - event.profile.start) * 1e-9
+        with self._lock:
+            profile = self.stages[stage]
+            if kind == "kernel":
+                profile.kernel_time += seconds
+                profile.kernels[name][0] += 1
+                profile.kernels[name][1] += seconds
+            else:
+                setattr(profile, kind + "_bytes", getattr(profile, kind + "_bytes") + nbytes)
+                profile.transfer_time += seconds
+
+    def build(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.builds[name] = self.builds.get(name, 0.0) + seconds
+
+    def memory(self, pool: str, change: int) -> None:
+        with self._lock:
+            self._current[pool] += change
+            self.peak_bytes[pool] = max(self.peak_bytes[pool], self._current[pool])
+
+    def reset(self) -> None:
+        # Program builds happen once per backend and are kept
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self.stages.clear()
+            self.peak_bytes = defaultdict(int, self._current)
+        for _, (_, _, _, event) in pending:
+            event.wait()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+    def report(self) -> dict:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for stage, record in pending:
+            self._resolve(stage, record)
+        peak_bytes = dict(self.peak_bytes)
+        if tracemalloc.is_tracing():
+            peak_bytes["host"] = tracemalloc.get_traced_memory()[1]
+        with self._lock:
+            return {
+                "stages": {name: profile.as_dict() for name, profile in self.stages.items()},
+                "builds": dict(self.builds),
+                "peak_bytes": peak_bytes,
+            }
+
+    def summary(self) -> str:
+        lines = []
+        for name, stage in sorted(self.report()["stages"].items(), key=lambda item: -item[1]["wall_time"]):
+            lines.append("{:<16} {:7.1f} ms wall {:7.1f} ms kernels {:6.1f} MiB copied".format(
+                name, stage["wall_time"] * 1000, stage["kernel_time"] * 1000,
+                (stage["to_device_bytes"] + stage["to_host_bytes"]) / (1 << 20)))
+        return "\n".join(lines)
+
+    def dump(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+
+from events import Seed, SeaLevel
+from maptypes import MapTypes
+from observables import Observer, Event
+from tiled_generator import TiledGenerator
+from tiles import tile_window
+
+# Samples along each side of a cached tile
+REGION_TILE_SIZE = 256
+# Resolution step of the preview whose height range colors regions while the full heights are not generated
+RANGE_STEP = 16
+
+REGION_LAYERS = (MapTypes.HEIGHT_MAP, MapTypes.MEAN_HEIGHT_MAP, MapTypes.GRADIENT_MAP, MapTypes.SLOPE_MAP,
+                 MapTypes.CONTINENT_MAP, MapTypes.COLOR_MAP)
+# Layers that depend on the sea level and the height range of the whole map
+RANGED_LAYERS = (MapTypes.CONTINENT_MAP, MapTypes.COLOR_MAP)
+
+
+class RegionRenderer(Observer):
+    """Generates windows of the maps of a controller from fixed size tiles, computing only the cells a window needs.
+
+    Tiles are the same as the maps the controller generates at the same scale, except for continents and colors
+    while those maps are not generated: the sea level and colors then come from the height range of a coarse
+    preview, which may miss the extremes by a little. Colors of regions leave the rivers out.
+    """
+
+    def __init__(self, controller, max_bytes: int = 256 << 20):
+        self.controller = controller
+        self.max_bytes = max_bytes
+        self._tiles = OrderedDict()
+        self._bytes = 0
+        self._generators = {}
+        self._lock = threading.Lock()
+        controller.subscribe(self)
+
+    def _generator(self, scale: int) -> TiledGenerator:
+        with self._lock:
+            if scale not in self._generators:
+                controller = self.controller
+                self._generators[scale] = TiledGenerator(
+                    controller.backend, controller.width, controller.height, controller.filters, controller.seed,
+                    controller.sea_level, max(1, controller.mean_radius // scale), REGION_TILE_SIZE,
+                    heights=controller.imported_heights)
+            return self._generators[scale]
+
+    def height_range(self, scale: int) -> Tuple[float, float]:
+        controller = self.controller if scale == 1 else self.controller.preview(scale)
+        if not controller.is_generated(MapTypes.HEIGHT_MAP):
+            controller = self.controller.preview(max(scale, RANGE_STEP))
+        statistics = controller.statistics
+        return statistics.min, statistics.max
+
+    def region(self, map_type: MapTypes, x0: int, y0: int, width: int, height: int, scale: int = 1) -> np.ndarray:
+        # Every scale-th cell of the world from the one at or before x0, y0 to the end of the rectangle,
+        # in the layout of the map_type layer
+        if map_type not in REGION_LAYERS:
+            raise ValueError("{} can not be generated in regions".format(map_type.name))
+        controller = self.controller
+        x1 = min(x0 + width, controller.width)
+        y1 = min(y0 + height, controller.height)
+        columns = (max(0, x0) // scale, -(-x1 // scale))
+        rows = (max(0, y0) // scale, -(-y1 // scale))
+        if columns[0] >= columns[1] or rows[0] >= rows[1]:
+            raise ValueError("Region {}x{} at {},{} is outside the map".format(width, height, x0, y0))
+
+        height_range = self.height_range(scale) if map_type in RANGED_LAYERS else None
+        result = None
+        for row in range(rows[0] // REGION_TILE_SIZE, (rows[1] - 1) // REGION_TILE_SIZE + 1):
+            for column in range(columns[0] // REGION_TILE_SIZE, (columns[1] - 1) // REGION_TILE_SIZE + 1):
+                tile = self._tile(map_type, scale, column, row, height_range)
+                if result is None:
+                    result = np.empty((rows[1] - rows[0], columns[1] - columns[0]) + tile.shape[2:], tile.dtype)
+                # Part of the tile inside the region, in tile and in region samples
+                tile_x, tile_y = column * REGION_TILE_SIZE, row * REGION_TILE_SIZE
+                left, top = max(columns[0], tile_x), max(rows[0], tile_y)
+                right = min(columns[1], tile_x + tile.shape[1])
+                bottom = min(rows[1], tile_y + tile.shape[0])
+                result[top - rows[0]:bottom - rows[0], left - columns[0]:right - columns[0]] = \
+                    tile[top - tile_y:bottom - tile_y, left - tile_x:right - tile_x]
+        return result
+
+    def _tile(self, map_type: MapTypes, scale: int, column: int, row: int, height_range) -> np.ndarray:
+        key = (map_type, scale, column, row, height_range)
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+        generator = self._generator(scale)
+        window = tile_window(generator.width, generator.height, REGION_TILE_SIZE, scale, column, row)
+        tile = generator.tile_layers(window, window.expand(generator.halo([map_type])), [map_type],
+                                     height_range)[map_type]
+        with self._lock:
+            if key not in self._tiles:
+                self._tiles[key] = tile
+                self._bytes += tile.nbytes
+            while self._bytes > self.max_bytes and len(self._tiles) > 1:
+                self._bytes -= self._tiles.popitem(last=False)[1].nbytes
+        return tile
+
+    def clear(self, map_types=REGION_LAYERS) -> None:
+        with self._lock:
+            self._generators.clear()
+            for key in [key for key in self._tiles if key[0] in map_types]:
+                self._bytes -= self._tiles.pop(key).nbytes
+
+    def handle(self, observable, event: Event):
+        if type(event) is Seed and self.controller.imported_heights is None:
+            self.clear()
+        elif type(event) is SeaLevel:
+            self.clear(RANGED_LAYERS)
@@ -1,39 +1,71 @@
+from typing import Optional
+
 import numpy as np
-import pyopencl as cl
 from PIL import Image
 
-from base_maps import CLMap
+from backend import Backend
+from base_maps import BackendMap
 from continent_map import ContinentMap
+from depressions import route
+from filled_height_map import FilledHeightMap
 from gradient_map import GradientMap
-from observables import Observable
+from events import Invalidated
+from observables import Observable, Event
+
+# Host copies hold upstream cell counts saturated at FLOW_MAX, the device keeps the full counts
+FLOW_DTYPE = np.uint16
+FLOW_MAX = np.iinfo(FLOW_DTYPE).max
 
 
-class RiverMap(CLMap):
-    def __init__(self, controller: Observable, width, height, ctx, gradient_map: GradientMap,
-                 continent_map: ContinentMap):
-        super().__init__(controller, width, height, ctx)
-        self.map_tools = cl.Program(self.ctx, open("maptools.cl").read()).build()
+class RiverMap(BackendMap):
+    def __init__(self, controller: Observable, width, height, backend: Backend, gradient_map: GradientMap,
+                 continent_map: ContinentMap, filled_height_map: Optional[FilledHeightMap], threshold: int = 500):
+        super().__init__(controller, width, height, backend)
+        self.threshold = threshold
         self.gradient_map = gradient_map
-        self.gradient_map.subscribe(self)
         self.continent_map = continent_map
-        self.continent_map.subscribe(self)
-        self.generate()
+        # Without filled heights rivers follow the gradient directions and may end in pits
+        self.filled_height_map = filled_height_map
+        # Flow does not depend on the land, only the host copy is cut to it
+        self.depends_on(gradient_map)
+        self.reads_on_host(continent_map)
+        if filled_height_map is not None:
+            self.depends_on(filled_height_map)
 
     def generate(self):
         if self.valid:
             return
-        self._map = np.zeros((self.height, self.width), np.int32)
-
-        queue = cl.CommandQueue(self.ctx)
-        gradient_buf = cl.Buffer(self.ctx, cl.mem_flags.COPY_HOST_PTR, hostbuf=self.gradient_map.get_map())
-        river_buf = cl.Buffer(self.ctx, cl.mem_flags.COPY_HOST_PTR, hostbuf=self._map)
-
-        event = self.map_tools.generate_rivers(queue, self._map.shape, None,
-                                               gradient_buf,
-                                               river_buf,
-                                               np.int32(self.width),
-                                               np.int32(self.height))
-        cl.enqueue_copy(queue, self._map, river_buf, wait_for=[event])
-        self._map[self.continent_map.get_map() == 0] = 0
-        self._map *= 10
-        self.image = Image.fromarray(self._map, 'I')
+        if self.filled_height_map is None:
+            self.set_data(self.backend.flow_accumulation(self.gradient_map.get_data()))
+            self.valid = True
+            return
+        # Rivers cross depressions towards their outlets instead of ending in them
+        directions = route(self.gradient_map.get_map(), self.filled_height_map.get_map(),
+                           self.filled_height_map.parents)
+        routed = self.backend.to_device(directions)
+        self.set_data(self.backend.flow_accumulation(routed))
+        self.backend.release(routed)
+        self.valid = True
+
+    def parameters(self):
+        return super().parameters() + (self.threshold,)
+
+    def to_host(self):
+        # Upstream cell count where it reaches the threshold on land, zero elsewhere
+        flow = self.backend.to_host(self._data)
+        rivers = np.minimum(flow, FLOW_MAX).astype(FLOW_DTYPE)
+        rivers[(flow < self.threshold) | (self.continent_map.get_map() == 0)] = 0
+        return rivers
+
+    @staticmethod
+    def to_image(array):
+        return Image.fromarray(array.astype(np.int32), 'I')
+
+    def handle(self, observable, event: Event):
+        if observable is self.continent_map and type(event) is Invalidated:
+            # Flow does not depend on the sea level, only the land mask is applied again
+            self._map = None
+            self.image = None
+            self.notify(event)
+        else:
+            super().handle(observable, event)
@@ -0,0 +1,93 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from typing import Callable, Iterable, Set
+
+from base_maps import Map
+from layer_cache import LayerCache
+from profiling import Profiler
+
+
+class Cancelled(Exception):
+    pass
+
+
+class LayerScheduler:
+    """Generates the invalid layers a request needs, independent layers run concurrently.
+
+    With a cache, layers generated before with the same key are read from disk instead.
+    """
+
+    def __init__(self, workers: int = 4, cache: LayerCache = None, profiler: Profiler = None, name: str = ""):
+        self.cache = cache
+        self.profiler = profiler
+        # Prefix of the profiled stage names, tells previews apart from full resolution maps
+        self.name = name
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="layer")
+
+    def pending(self, maps: Iterable[Map]) -> Set[Map]:
+        # Invalid layers to generate, layers read from the cache instead are loaded here and their inputs left alone
+        result = set()
+        # Only the requested layers are copied to the host, the maps they read for it are needed, see RiverMap
+        stack = list(maps) + [input_map for layer in maps for input_map in layer.host_inputs]
+        seen = set()
+        while stack:
+            layer = stack.pop()
+            if layer in seen:
+                continue
+            seen.add(layer)
+            if layer.valid or self._load(layer):
+                continue
+            result.add(layer)
+            stack.extend(layer.inputs)
+        return result
+
+    def update(self, *maps: Map, cancelled: Callable[[], bool] = None) -> None:
+        pending = self.pending(maps)
+        running = {}
+        while pending or running:
+            if cancelled is not None and cancelled():
+                # Layers already running are finished, they stay valid for later requests
+                pending.clear()
+            busy = pending | set(running.values())
+            ready = [layer for layer in pending if not any(input_map in busy for input_map in layer.inputs)]
+            for layer in ready:
+                pending.remove(layer)
+                running[self._executor.submit(self._generate, layer)] = layer
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                error = future.exception()
+                if error is not None:
+                    # Layers still running would otherwise race with the next update over the same maps
+                    wait(running)
+                    raise error
+        if cancelled is not None and cancelled():
+            raise Cancelled()
+
+    def _stage(self, layer: Map):
+        return self.profiler.stage(self.name + type(layer).__name__) if self.profiler is not None else nullcontext()
+
+    def _load(self, layer: Map) -> bool:
+        # Inputs cut short do not match the key, which describes the complete ones
+        if self.cache is None or not layer.cacheable or not layer.complete:
+            return False
+        array = self.cache.get(layer.key)
+        if array is None:
+            return False
+        with self._stage(layer) as stage:
+            if stage is not None:
+                stage.cache_hit = True
+            layer.load(array)
+        return True
+
+    def _generate(self, layer: Map) -> None:
+        # Checked before generating, ContinentMap for example is only cacheable until the sea level moves
+        key = layer.key if self.cache is not None and layer.cacheable and layer.complete else None
+        with self._stage(layer):
+            layer.generate()
+            # Results cut short are never cached, see Map.complete
+            if key is not None and layer.complete:
+                self.cache.put(key, layer.dump())
+
+    def shutdown(self):
+        self._executor.shutdown()
@@ -0,0 +1,30 @@
+from PIL import Image
+
+from backend import Backend
+from base_maps import BackendMap
+from gradient_map import GradientMap
+from observables import Observable
+
+
+class SlopeMap(BackendMap):
+    """Gradient magnitude of the mean heights, for shading."""
+
+    def __init__(self, controller: Observable, width, height, backend: Backend, gradient_map: GradientMap):
+        super().__init__(controller, width, height, backend)
+        self.gradient_map = gradient_map
+        self.depends_on(gradient_map)
+
+    def generate(self):
+        if self.valid:
+            return
+        slope = self.gradient_map.take_slope()
+        if slope is None:
+            # Directions read from the layer cache come without slopes
+            directions, slope = self.backend.gradient_directions(self.gradient_map.mean_height_map.get_data(), True)
+            self.backend.release(directions)
+        self.set_data(slope)
+        self.valid = True
+
+    @staticmethod
+    def to_image(array):
+        return Image.fromarray(array, "F")
@@ -0,0 +1,25 @@
+import numpy as np
+
+from batch_generator import BatchGenerator
+from controller import Controller
+from main import scale_pair
+from maptypes import MapTypes
+from numpy_backend import NumpyBackend
+
+FILTERS = scale_pair("500/1,100/0.3,20/0.05")
+LAYERS = (MapTypes.HEIGHT_MAP, MapTypes.CONTINENT_MAP, MapTypes.RIVER_MAP, MapTypes.COLOR_MAP)
+
+
+def test_no_seeds_give_empty_arrays():
+    outputs = BatchGenerator(NumpyBackend(2), 32, 16, FILTERS).generate([], LAYERS)
+    assert outputs[MapTypes.HEIGHT_MAP].shape == (0, 16, 32)
+    assert outputs[MapTypes.COLOR_MAP].shape == (0, 16, 32, 4)
+
+
+def test_maps_match_a_controller():
+    backend = NumpyBackend(2)
+    outputs = BatchGenerator(backend, 48, 40, FILTERS, 60, 5, 20).generate(["3", "4"], LAYERS)
+    for index, seed in enumerate(["3", "4"]):
+        controller = Controller(48, 40, FILTERS, 60, seed, backend, 5, 20)
+        for layer in LAYERS:
+            assert np.array_equal(outputs[layer][index], controller.get_map(layer)), layer
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from depressions import priority_flood, route
+from numpy_backend import DIRECTION_DX, DIRECTION_DY, NumpyBackend
+
+
+def opencl_backend():
+    cl = pytest.importorskip("pyopencl")
+    from cl_backend import CLBackend
+    try:
+        return CLBackend()
+    except cl.Error as e:
+        pytest.skip("No OpenCL device: {}".format(e))
+
+
+@pytest.fixture(params=["numpy", "opencl"])
+def backend(request):
+    return NumpyBackend(2) if request.param == "numpy" else opencl_backend()
+
+
+def flow(backend, directions):
+    array = backend.to_device(np.asarray(directions, np.uint8))
+    result = backend.flow_accumulation(array)
+    host = backend.to_host(result)
+    backend.release(array)
+    backend.release(result)
+    return host
+
+
+def drains_off_map(directions):
+    # True when following the directions from every cell leaves the map
+    height, width = directions.shape
+    for start in range(directions.size):
+        y, x = divmod(start, width)
+        for _ in range(directions.size):
+            code = directions[y, x]
+            y, x = y + DIRECTION_DY[code], x + DIRECTION_DX[code]
+            if not (0 <= x < width and 0 <= y < height):
+                break
+        else:
+            return False
+    return True
+
+
+def test_single_sink(backend):
+    # Every cell drains into the centre, which drains through the bottom middle cell off the map
+    directions = [[1, 0, 7],
+                  [2, 0, 6],
+                  [3, 0, 5]]
+    assert np.array_equal(flow(backend, directions), [[1, 1, 1],
+                                                      [1, 8, 1],
+                                                      [1, 9, 1]])
+
+
+def test_long_chain(backend):
+    # More levels than are launched between two reads of the frontier size
+    directions = np.full((1, 200), 2, np.uint8)
+    assert np.array_equal(flow(backend, directions)[0], np.arange(1, 201))
+
+
+def test_backends_match_on_random_directions():
+    directions = np.random.default_rng(5).integers(0, 8, (37, 53), dtype=np.uint8)
+    assert np.array_equal(flow(NumpyBackend(2), directions), flow(opencl_backend(), directions))
+
+
+def test_closed_depression_fills_to_its_spill_height(backend):
+    surface = np.full((5, 5), 3, np.float32)
+    surface[1:4, 1:4] = 1
+    surface[0, 2] = 2
+    filled, parents = priority_flood(surface)
+    expected = surface.copy()
+    expected[1:4, 1:4] = 2
+    assert np.array_equal(filled, expected)
+    # Flow into the pit is routed out over the outlet
+    into_pit = np.array([[0, 0, 0, 0, 0],
+                         [1, 1, 0, 7, 7],
+                         [2, 2, 0, 6, 6],
+                         [3, 3, 4, 5, 5],
+                         [4, 4, 4, 4, 4]], np.uint8)
+    routed = route(into_pit, filled, parents)
+    assert drains_off_map(routed)
+    # The outlet leaves the map to the north with the nine cells of the pit and itself at least
+    assert routed[0, 2] == 4
+    assert flow(backend, routed)[0, 2] >= 10
+
+
+def test_plateau_is_left_as_it_is_and_drains_off_map():
+    surface = np.full((6, 7), 4, np.float32)
+    filled, parents = priority_flood(surface)
+    assert np.array_equal(filled, surface)
+    # Flat cells have no descending direction, all of them point at their neighbour to the south east
+    routed = route(np.full(surface.shape, 1, np.uint8), filled, parents)
+    assert drains_off_map(routed)
+    assert flow(NumpyBackend(2), routed).max() <= surface.size
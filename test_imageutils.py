@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from imageutils import load_image, save_image
+
+
+def test_rgb_image_is_read_as_grey_levels(tmp_path):
+    rgb = np.zeros((3, 5, 3), np.uint8)
+    rgb[1, 2] = (255, 255, 255)
+    rgb[2, 4] = (255, 0, 0)
+    path = str(tmp_path / "heights.png")
+    Image.fromarray(rgb, "RGB").save(path)
+    heights = load_image(path)
+    assert heights.shape == (3, 5)
+    assert heights[0, 0] == 0
+    assert heights[1, 2] == 255
+    assert 0 < heights[2, 4] < 255
+
+
+def test_rgba_image_leaves_out_alpha(tmp_path):
+    rgba = np.full((2, 2, 4), 100, np.uint8)
+    rgba[..., 3] = 0
+    path = str(tmp_path / "heights.png")
+    Image.fromarray(rgba, "RGBA").save(path)
+    assert np.allclose(load_image(path), 100, atol=1)
+
+
+def test_16_bit_image_keeps_its_values(tmp_path):
+    heights = np.array([[0, 1000], [40000, 65535]], np.uint16)
+    path = str(tmp_path / "heights.png")
+    save_image(heights, path)
+    assert np.array_equal(load_image(path), heights)
+
+
+def test_raw_file_of_the_wrong_size_is_rejected(tmp_path):
+    path = str(tmp_path / "heights.r16")
+    np.zeros((30, 50), "<u2").tofile(path)
+    assert load_image(path, 50, 30).shape == (30, 50)
+    with pytest.raises(ValueError):
+        load_image(path)
+    with pytest.raises(ValueError):
+        load_image(path, 1200, 1000)
@@ -0,0 +1,186 @@
+import io
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from backend import create_backend
+from controller import Controller
+from main import check_positive_integer, erosion_settings, layer_cache, map_arguments, parse_map_arguments
+from maptypes import MapTypes
+from profiling import Profiler
+from regions import REGION_TILE_SIZE
+
+# Pixels along each side of a served tile, the same as the region tiles so one never needs two of them
+TILE_SIZE = REGION_TILE_SIZE
+TILE_PATH = re.compile(r'^/([a-z_]+)/([^/]+)/(\d+)/(\d+)/(\d+)\.png$')
+
+
+class Busy(Exception):
+    pass
+
+
+def tile_image(image: Image) -> Image:
+    # TILE_SIZE x TILE_SIZE image for web viewers, float and integer layers clipped to 8 bits like in the GUI,
+    # tiles at the right and bottom edges of the world padded with black or transparent pixels
+    if image.mode != "RGBA":
+        image = image.convert("L")
+    if image.size == (TILE_SIZE, TILE_SIZE):
+        return image
+    tile = Image.new(image.mode, (TILE_SIZE, TILE_SIZE))
+    tile.paste(image, (0, 0))
+    return tile
+
+
+class TileRenderer:
+    """Renders XYZ tiles of the worlds of any seed into PNG files, from the highest zoom level, one cell per pixel,
+    down to the one whose single tile covers the whole world.
+
+    Renders run on a fixed pool of threads with at most max_pending tiles queued or running, requests for a tile
+    that is already being rendered wait for that render. Encoded tiles are kept up to max_bytes, the controllers
+    of the last max_worlds seeds with their own region tiles.
+    """
+
+    def __init__(self, args, backend, workers: int = 4, max_pending: int = 64, max_bytes: int = 256 << 20,
+                 max_worlds: int = 4):
+        self.args = args
+        self.backend = backend
+        self.cache = layer_cache(args)
+        self.erosion = erosion_settings(args)
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+        self.max_worlds = max_worlds
+        # One world cell per pixel, level 0 covers the whole world with one tile
+        self.max_zoom = ((max(args.xSize, args.ySize) - 1) // TILE_SIZE).bit_length()
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="tile")
+        self._rendering = {}
+        self._tiles = OrderedDict()
+        self._bytes = 0
+        self._worlds = OrderedDict()
+        self._lock = threading.Lock()
+
+    def world(self, seed: str) -> Controller:
+        with self._lock:
+            if seed in self._worlds:
+                self._worlds.move_to_end(seed)
+            else:
+                args = self.args
+                self._worlds[seed] = Controller(args.xSize, args.ySize, args.filters, args.sea_level, seed,
+                                                self.backend, args.mean_radius, args.river_threshold, self.cache,
+                                                height_source=args.heightmap, height_dtype=args.height_dtype,
+                                                erosion=self.erosion, fill_depressions=args.fill_depressions)
+                if len(self._worlds) > self.max_worlds:
+                    self._worlds.popitem(last=False)
+            return self._worlds[seed]
+
+    def tile(self, map_type: MapTypes, seed: str, z: int, x: int, y: int) -> bytes:
+        # PNG of a tile, raises ValueError for tiles outside the world and Busy when too many are waiting
+        if z > self.max_zoom:
+            raise ValueError("Zoom {} is above the highest level {}".format(z, self.max_zoom))
+        scale = 1 << (self.max_zoom - z)
+        if x * TILE_SIZE * scale >= self.args.xSize or y * TILE_SIZE * scale >= self.args.ySize:
+            raise ValueError("Tile {}/{}/{} is outside the world".format(z, x, y))
+        key = (map_type, seed, z, x, y)
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+            future = self._rendering.get(key)
+            if future is None:
+                if len(self._rendering) >= self.max_pending:
+                    raise Busy()
+                future = self._rendering[key] = self._pool.submit(self._render, key, scale)
+        return future.result()
+
+    def _render(self, key, scale: int) -> bytes:
+        map_type, seed, z, x, y = key
+        try:
+            size = TILE_SIZE * scale
+            image = self.world(seed).get_region(map_type, x * size, y * size, size, size, scale)
+            output = io.BytesIO()
+            tile_image(image).save(output, "PNG")
+            data = output.getvalue()
+        except BaseException:
+            with self._lock:
+                del self._rendering[key]
+            raise
+        with self._lock:
+            del self._rendering[key]
+            self._tiles[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._tiles) > 1:
+                self._bytes -= len(self._tiles.popitem(last=False)[1])
+        return data
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    # /{map_type}/{seed}/{z}/{x}/{y}.png, map types in lower case as in MapTypes
+    renderer: TileRenderer = None
+
+    def do_GET(self):
+        match = TILE_PATH.match(self.path.split('?')[0])
+        if match is None or match.group(1).upper() not in MapTypes.__members__:
+            self.send_error(404, "Expected /{map_type}/{seed}/{z}/{x}/{y}.png")
+            return
+        map_type, seed = MapTypes[match.group(1).upper()], match.group(2)
+        try:
+            data = self.renderer.tile(map_type, seed, *(int(part) for part in match.group(3, 4, 5)))
+        except ValueError as e:
+            self.send_error(404, str(e))
+            return
+        except Busy:
+            self.send_response(503)
+            self.send_header("Retry-After", "1")
+            self.end_headers()
+            return
+        except Exception as e:
+            self.send_error(500, str(e))
+            raise
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        # The same parameters always give the same tile
+        self.send_header("Cache-Control", "public, max-age=86400")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.renderer.args.verbose:
+            super().log_message(format, *args)
+
+
+def main():
+    p = map_arguments("Serve XYZ tiles of generated worlds to web map viewers")
+    p.add('--host', default='127.0.0.1', help="Address to listen on, the default only accepts local connections")
+    p.add('--port', type=check_positive_integer, default=8000)
+    p.add('--render_threads', type=check_positive_integer, default=4, help="Tiles rendered at once")
+    p.add('--queue_size', type=check_positive_integer, default=64,
+          help="Tiles waiting or being rendered before requests are answered with 503")
+    p.add('--tile_cache_size', type=check_positive_integer, default=256, help="Size limit of the PNG tiles in MiB")
+    p.add('--worlds', type=check_positive_integer, default=4, help="Seeds whose maps are kept in memory")
+    p.add('-v', '--verbose', action='store_true', help="Log every request")
+    args = parse_map_arguments(p)
+
+    profiler = Profiler() if args.profile else None
+    renderer = TileRenderer(args, create_backend(args.backend, args.workers, profiler), max(1, args.render_threads),
+                            max(1, args.queue_size), args.tile_cache_size << 20, max(1, args.worlds))
+    handler = type("Handler", (TileRequestHandler,), {"renderer": renderer})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    print("Serving zoom levels 0-{} on http://{}:{}/color_map/{}/{{z}}/{{x}}/{{y}}.png".format(
+        renderer.max_zoom, args.host, args.port, args.seed))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if profiler is not None:
+            profiler.dump(args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import os
+from contextlib import nullcontext
+from typing import Dict, Sequence
+
+import numpy as np
+
+from backend import Backend, create_backend
+from color_map import DEFAULT_COLOR_RANGES, ColorRange, color_lut, height_ranges
+from continent_map import LAND_DTYPE
+from height_map import octaves
+from imageutils import load_image, save_png
+from main import check_positive_integer, erosion_settings, map_arguments, parse_map_arguments
+from maptypes import MapTypes
+from profiling import Profiler
+from tiles import Window, iter_tiles
+
+TILED_LAYERS = (MapTypes.HEIGHT_MAP, MapTypes.MEAN_HEIGHT_MAP, MapTypes.GRADIENT_MAP, MapTypes.SLOPE_MAP,
+                MapTypes.CONTINENT_MAP, MapTypes.COLOR_MAP)
+
+
+class TiledGenerator:
+    """Generates maps larger than memory tile by tile into .npy memory maps.
+
+    Every tile is computed from world coordinates, stencil stages get a halo of neighbouring cells so
+    tiles match a map generated in one piece up to float rounding. Rivers need the whole map and are not tiled.
+    """
+
+    def __init__(self, backend: Backend, width: int, height: int, filters, seed, sea_level=75, mean_radius=30,
+                 tile_size=1024, color_ranges: Sequence[ColorRange] = DEFAULT_COLOR_RANGES, heights: np.ndarray = None):
+        self.backend = backend
+        # Imported heights to cut the tiles from instead of generating them
+        self.heights = heights
+        self.width = width
+        self.height = height
+        self.octaves = octaves(seed, filters)
+        self.sea_level = sea_level
+        self.mean_radius = mean_radius
+        self.tile_size = tile_size
+        self.color_ranges = color_ranges
+
+    def tiles(self):
+        return iter_tiles(self.width, self.height, self.tile_size)
+
+    def height_tile(self, window: Window):
+        if self.heights is not None:
+            rows = slice(window.y, window.y + window.height * window.step, window.step)
+            columns = slice(window.x, window.x + window.width * window.step, window.step)
+            return self.backend.to_device(np.asarray(self.heights[rows, columns], np.float32))
+        return self.backend.height_map(window, self.octaves)
+
+    def _stage(self, name):
+        profiler = self.backend.profiler
+        return profiler.stage(name) if profiler is not None else nullcontext()
+
+    def height_range(self):
+        low, high = np.inf, -np.inf
+        for window in self.tiles():
+            with self._stage("height range"):
+                tile = self.height_tile(window)
+                tile_low, tile_high = self.backend.min_max(tile)
+                low, high = min(low, tile_low), max(high, tile_high)
+                self.backend.release(tile)
+        return low, high
+
+    def generate(self, directory: str, layers=TILED_LAYERS) -> Dict[MapTypes, str]:
+        os.makedirs(directory, exist_ok=True)
+        paths = {layer: os.path.join(directory, layer.name.lower() + ".npy") for layer in layers}
+        shape = (self.height, self.width)
+        outputs = {}
+        for layer in layers:
+            if layer is MapTypes.COLOR_MAP:
+                outputs[layer] = np.lib.format.open_memmap(paths[layer], 'w+', np.uint8, shape + (3,))
+            elif layer is MapTypes.GRADIENT_MAP:
+                outputs[layer] = np.lib.format.open_memmap(paths[layer], 'w+', np.uint8, shape)
+            elif layer is MapTypes.CONTINENT_MAP:
+                outputs[layer] = np.lib.format.open_memmap(paths[layer], 'w+', LAND_DTYPE, shape)
+            elif layer in (MapTypes.HEIGHT_MAP, MapTypes.MEAN_HEIGHT_MAP, MapTypes.SLOPE_MAP):
+                outputs[layer] = np.lib.format.open_memmap(paths[layer], 'w+', np.float32, shape)
+            else:
+                raise ValueError("{} can not be generated in tiles".format(layer.name))
+
+        height_range = None
+        if MapTypes.CONTINENT_MAP in outputs or MapTypes.COLOR_MAP in outputs:
+            height_range = self.height_range()
+
+        halo = self.halo(layers)
+        for window in self.tiles():
+            with self._stage("tile"):
+                target = (slice(window.y, window.y + window.height), slice(window.x, window.x + window.width))
+                for layer, array in self.tile_layers(window, window.expand(halo), layers, height_range).items():
+                    if layer is MapTypes.COLOR_MAP:
+                        array = array[..., :3]
+                    outputs[layer][target] = array
+        for output in outputs.values():
+            output.flush()
+        return paths
+
+    def halo(self, layers) -> int:
+        # Cells around a tile the stencils of layers read
+        if MapTypes.GRADIENT_MAP in layers or MapTypes.SLOPE_MAP in layers:
+            return self.mean_radius + 1
+        if MapTypes.MEAN_HEIGHT_MAP in layers:
+            return self.mean_radius
+        return 0
+
+    def tile_layers(self, window: Window, padded: Window, layers, height_range=None) -> Dict[MapTypes, np.ndarray]:
+        # Host arrays of window, in the layouts of the layer classes, computed from the heights of padded
+        backend = self.backend
+        inner = padded.crop(window)
+        heights = self.height_tile(padded)
+        temporary = [heights]
+        result = {}
+        if MapTypes.HEIGHT_MAP in layers:
+            result[MapTypes.HEIGHT_MAP] = backend.to_host(heights)[inner]
+        if MapTypes.MEAN_HEIGHT_MAP in layers or MapTypes.GRADIENT_MAP in layers or MapTypes.SLOPE_MAP in layers:
+            mean = backend.mean(heights, self.mean_radius)
+            temporary.append(mean)
+            if MapTypes.MEAN_HEIGHT_MAP in layers:
+                result[MapTypes.MEAN_HEIGHT_MAP] = backend.to_host(mean)[inner]
+            if MapTypes.GRADIENT_MAP in layers or MapTypes.SLOPE_MAP in layers:
+                directions, slope = backend.gradient_directions(mean, MapTypes.SLOPE_MAP in layers)
+                temporary.append(directions)
+                if MapTypes.GRADIENT_MAP in layers:
+                    result[MapTypes.GRADIENT_MAP] = backend.to_host(directions)[inner]
+                if slope is not None:
+                    temporary.append(slope)
+                    result[MapTypes.SLOPE_MAP] = backend.to_host(slope)[inner]
+        if MapTypes.CONTINENT_MAP in layers:
+            effective_sea_level = height_range[1] * self.sea_level / 100
+            result[MapTypes.CONTINENT_MAP] = (backend.to_host(heights)[inner] > effective_sea_level).astype(LAND_DTYPE)
+        if MapTypes.COLOR_MAP in layers:
+            lut = color_lut(height_ranges(self.color_ranges, self.sea_level, height_range[1]), *height_range)
+            colors = backend.lut_colors(heights, lut, *height_range)
+            temporary.append(colors)
+            result[MapTypes.COLOR_MAP] = backend.to_host(colors)[inner]
+        # Copies, so the results outlive the device buffers released below
+        result = {layer: np.array(array) for layer, array in result.items()}
+        for array in temporary:
+            backend.release(array)
+        return result
+
+
+def main():
+    p = map_arguments("Generate a map tile by tile into .npy files")
+    p.add('--tile_size', type=check_positive_integer, default=1024)
+    p.add('--layers', default=",".join(layer.name.lower() for layer in TILED_LAYERS),
+          help="Comma separated layers to write")
+    p.add('-o', '--output', required=True, help="Directory for the .npy files")
+    p.add('--png', action='store_true', help="Also write the color map as png, a few rows at a time")
+    args = parse_map_arguments(p)
+    if erosion_settings(args) is not None:
+        p.error("Erosion needs the whole map at once, it can not be generated tile by tile")
+    if args.height_dtype != 'float32':
+        p.error("Tiles are written as float32, --height_dtype {} is not supported".format(args.height_dtype))
+
+    layers = [MapTypes[name.strip().upper()] for name in args.layers.split(",")]
+    profiler = Profiler() if args.profile else None
+    generator = TiledGenerator(create_backend(args.backend, args.workers, profiler), args.xSize, args.ySize,
+                               args.filters, args.seed, args.sea_level, args.mean_radius, args.tile_size,
+                               heights=load_image(args.heightmap, args.xSize, args.ySize) if args.heightmap else None)
+    paths = generator.generate(args.output, layers)
+    if args.png and MapTypes.COLOR_MAP in paths:
+        paths["png"] = os.path.splitext(paths[MapTypes.COLOR_MAP])[0] + ".png"
+        save_png(np.load(paths[MapTypes.COLOR_MAP], mmap_mode='r'), paths["png"])
+    for path in paths.values():
+        print(path)
+    if profiler is not None:
+        profiler.dump(args.profile)
+
+
+if __name__ == "__main__":
+    main()
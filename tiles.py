@@ -0,0 +1,52 @@
+from typing import Iterator, NamedTuple
+
+
+class Window(NamedTuple):
+    """A width x height region at (x, y) of a world_width x world_height map, sampling every step-th cell."""
+    x: int
+    y: int
+    width: int
+    height: int
+    world_width: int
+    world_height: int
+    step: int = 1
+
+    @classmethod
+    def full(cls, width: int, height: int, step: int = 1) -> 'Window':
+        return cls(0, 0, -(-width // step), -(-height // step), width, height, step)
+
+    @property
+    def shape(self):
+        return self.height, self.width
+
+    def expand(self, halo: int) -> 'Window':
+        # Grow by halo samples on every side, clipped to the world
+        left = min(halo, self.x // self.step)
+        top = min(halo, self.y // self.step)
+        right = min(halo, (self.world_width - 1 - self.x) // self.step - self.width + 1)
+        bottom = min(halo, (self.world_height - 1 - self.y) // self.step - self.height + 1)
+        return Window(self.x - left * self.step, self.y - top * self.step, self.width + left + right,
+                      self.height + top + bottom, self.world_width, self.world_height, self.step)
+
+    def crop(self, inner: 'Window'):
+        # Slices of this window's array that cover inner
+        x0 = (inner.x - self.x) // self.step
+        y0 = (inner.y - self.y) // self.step
+        return slice(y0, y0 + inner.height), slice(x0, x0 + inner.width)
+
+
+def iter_tiles(world_width: int, world_height: int, tile_size: int) -> Iterator[Window]:
+    for y in range(0, world_height, tile_size):
+        for x in range(0, world_width, tile_size):
+            yield Window(x, y, min(tile_size, world_width - x), min(tile_size, world_height - y),
+                         world_width, world_height)
+
+
+def tile_window(world_width: int, world_height: int, tile_size: int, step: int, column: int, row: int) -> Window:
+    # Tile of tile_size x tile_size samples in the grid of every step-th cell
+    samples_x = -(-world_width // step)
+    samples_y = -(-world_height // step)
+    x = column * tile_size
+    y = row * tile_size
+    return Window(x * step, y * step, min(tile_size, samples_x - x), min(tile_size, samples_y - y),
+                  world_width, world_height, step)
@@ -1,21 +1,43 @@
+import queue
 import random
 import re
 import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import ttk
 
 from PIL import ImageTk
 
+from backend import create_backend
 from controller import Controller
+from main import erosion_settings, layer_cache
 from maptypes import MapTypes
+from profiling import Profiler
+from scheduler import Cancelled
+
+# Milliseconds between checks for a finished map
+POLL_INTERVAL = 20
 
 
 class Gui(ttk.Frame):
     def __init__(self, args, parent=tk.Tk()):
         super().__init__(parent, padding="3 3 12 12")
         self.parent = parent
-        self.controller = Controller(args.xSize, args.ySize, args.filters, args.sea_level, args.seed)
+        self.profiler = Profiler() if args.profile or args.profile_overlay else None
+        self.controller = Controller(args.xSize, args.ySize, args.filters, args.sea_level, args.seed,
+                                     create_backend(args.backend, args.workers, self.profiler), args.mean_radius,
+                                     args.river_threshold, layer_cache(args), height_source=args.heightmap,
+                                     height_dtype=args.height_dtype, erosion=erosion_settings(args),
+                                     fill_depressions=args.fill_depressions)
         self.parent.title("Random map generator")
         self.args = args
+        # One worker owns the controller, requests replace each other instead of queueing up
+        self._worker = ThreadPoolExecutor(1, thread_name_prefix="map")
+        self._request = 0
+        self._images = queue.Queue()
+        self._map_type = MapTypes.COLOR_MAP
+        self._statistics = None
+        # Status text of the erosion, set by the worker and shown by _poll
+        self._erosion_status = None
         self.controls = ttk.Frame(self)
         self.controls.grid(column=0, row=0, sticky=(tk.W, tk.N))
 
@@ -56,6 +78,8 @@ class Gui(ttk.Frame):
         sea_level_slider = ttk.Scale(self.controls, from_=0, to=100, variable=self.sea_level_value,
                                      command=self._show_sea_level, orient="horizontal")
         sea_level_slider.grid(column=1, row=4)
+        # Only the sea level changes, the map is drawn again with the seed it has
+        sea_level_slider.bind("<ButtonRelease-1>", lambda event: self._show_map(self._map_type, random_seed=False))
         self.sea_level_display = tk.Label(self.controls, text=args.sea_level)
         self.sea_level_display.grid(column=0, row=4, sticky=(tk.E, tk.N))
 
@@ -64,15 +88,80 @@ class Gui(ttk.Frame):
         ttk.Button(self.controls, text="Show continents", command=self.show_continent_map).grid(column=1,
                                                                                                        row=6)
         ttk.Button(self.controls, text="Show gradient map", command=self.show_gradient_map).grid(row=7, column=0)
+        ttk.Button(self.controls, text="Show slopes", command=self.show_slope_map).grid(row=7, column=1)
         ttk.Button(self.controls, text="Show waterfall map", command=self.show_rivers).grid(row=8, column=0)
+        ttk.Button(self.controls, text="Show lakes", command=self.show_lakes).grid(row=8, column=1)
+        self.status = tk.Label(self.controls)
+        self.status.grid(column=0, row=9, columnspan=2, sticky=(tk.W, tk.N))
+        self.profile_overlay = tk.Label(self.controls, font="TkFixedFont", justify=tk.LEFT)
+        if args.profile_overlay:
+            self.profile_overlay.grid(column=0, row=10, columnspan=2, sticky=(tk.W, tk.N))
+
+        self.map_label = tk.Label(self)
+        self.map_label.grid(column=2, row=0)
 
     def start(self):
         self._show_map(MapTypes.COLOR_MAP)
         self.parent.mainloop()
+        if self.args.profile:
+            self.profiler.dump(self.args.profile)
+
+    def _show_map(self, map_type, random_seed=True):
+        self._map_type = map_type
+        self._request += 1
+        request = self._request
+        seed, sea_level = self._map_parameters(random_seed)
+        self.status['text'] = "Generating..."
+        self._poll(request, self._worker.submit(self._generate, request, map_type, seed, sea_level))
+
+    def _generate(self, request, map_type, seed, sea_level):
+        # Runs on the worker, anything but the newest request is given up at the next layer
+        def cancelled():
+            return request != self._request
+
+        def erosion_progress(done, total):
+            # Stale requests give up in the middle of the erosion too, their heights stay invalid
+            if cancelled():
+                raise Cancelled()
+            self._erosion_status = "Eroding {}/{}...".format(done, total)
+            return True
 
-    def _show_map(self, map_type):
-        self._set_map_parameters()
-        self._show_image(self.controller.get_map_image(map_type))
+        if cancelled():
+            raise Cancelled()
+        self.controller.set_erosion_progress(erosion_progress)
+        self.controller.set_seed(seed)
+        self.controller.set_sea_level(sea_level)
+        for image in self.controller.progressive_images(map_type, cancelled):
+            self._images.put((request, image))
+        statistics = self.controller.statistics
+        # Built here so the slider never has to touch the maps from the Tk thread
+        statistics.histogram
+        return statistics
+
+    def _poll(self, request, future):
+        if request != self._request:
+            return
+        # Checked before draining, a finished worker has queued all of its images
+        done = future.done()
+        latest = None
+        while not self._images.empty():
+            image_request, image = self._images.get()
+            if image_request == request:
+                latest = image
+        if latest is not None:
+            self._show_image(latest)
+        if self._erosion_status is not None:
+            self.status['text'], self._erosion_status = self._erosion_status, None
+        if not done:
+            self.after(POLL_INTERVAL, self._poll, request, future)
+            return
+        try:
+            self._statistics = future.result()
+        except Cancelled:
+            return
+        self.status['text'] = ""
+        if self.args.profile_overlay:
+            self.profile_overlay['text'] = self.profiler.summary()
 
     def show_color_map(self):
         self._show_map(MapTypes.COLOR_MAP)
@@ -83,23 +172,27 @@ class Gui(ttk.Frame):
     def show_continent_map(self):
         self._show_map(MapTypes.CONTINENT_MAP)
 
-    def _set_map_parameters(self):
-        if self.random_seed.get():
+    def _map_parameters(self, random_seed=True):
+        if random_seed and self.random_seed.get():
             self.seed_value.set(random.randint(0, 10000))
-        self.controller.set_seed(self.seed_value.get())
-        self.controller.set_sea_level(self.sea_level_value.get())
+        return self.seed_value.get(), self.sea_level_value.get()
 
     def show_gradient_map(self):
         self._show_map(MapTypes.GRADIENT_MAP)
 
+    def show_slope_map(self):
+        self._show_map(MapTypes.SLOPE_MAP)
+
     def show_rivers(self):
         self._show_map(MapTypes.RIVER_MAP)
 
+    def show_lakes(self):
+        self._show_map(MapTypes.LAKE_MAP)
+
     def _show_image(self, image):
         photo = ImageTk.PhotoImage(image)
-        map_label = tk.Label(self, image=photo)
-        map_label.image = photo
-        map_label.grid(column=2, row=0)
+        self.map_label.configure(image=photo)
+        self.map_label.image = photo
 
     def _random_seed_action(self):
         if self.random_seed.get():
@@ -115,4 +208,8 @@ class Gui(ttk.Frame):
         return False
 
     def _show_sea_level(self, value):
-        self.sea_level_display['text'] = int(float(value))
+        if self._statistics is None:
+            self.sea_level_display['text'] = int(float(value))
+            return
+        land = self._statistics.land_fraction(float(value))
+        self.sea_level_display['text'] = "{} ({:.0%} land)".format(int(float(value)), land)